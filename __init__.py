@@ -32,3 +32,8 @@ class MangaDexStore(StoreBase):
     drm_free_only = True
     actual_plugin = "calibre_plugins.store_mangadex.mangadex_plugin:MangaDexStorePlugin"
     formats = ["CBZ"]
+
+    def cli_main(self, args):
+        # calibre-debug -r MangaDex -- MANIFEST [options]
+        from calibre_plugins.store_mangadex.cli import main
+        raise SystemExit(main(args[1:]))
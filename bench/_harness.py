@@ -0,0 +1,126 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "calibre_plugins.store_mangadex"
+
+
+def load_plugin(work_dir: str | None = None) -> types.ModuleType:
+    """
+    Import the plugin from this working tree (not the installed ZIP) under
+    its calibre name, and point its cache directories at `work_dir`.
+    Must run inside calibre's Python, e.g. `calibre-debug -e bench/e2e.py`.
+    """
+    if PACKAGE not in sys.modules or \
+            os.path.dirname(sys.modules[PACKAGE].__file__) != REPO_DIR:
+        parent = sys.modules.get("calibre_plugins")
+        if parent is None:
+            parent = sys.modules["calibre_plugins"] = types.ModuleType("calibre_plugins")
+            parent.__path__ = []
+        spec = importlib.util.spec_from_file_location(
+            PACKAGE, os.path.join(REPO_DIR, "__init__.py"),
+            submodule_search_locations=[REPO_DIR])
+        pkg = importlib.util.module_from_spec(spec)
+        sys.modules[PACKAGE] = pkg
+        spec.loader.exec_module(pkg)
+        setattr(parent, "store_mangadex", pkg)
+    pkg = sys.modules[PACKAGE]
+
+    def get_resources(path):
+        with open(os.path.join(REPO_DIR, path), "rb") as f:
+            return f.read()
+    pkg.get_resources = get_resources
+
+    work_dir = work_dir or tempfile.mkdtemp(prefix="mangadex-bench-")
+    cache = importlib.import_module(PACKAGE + ".lib.cache")
+    search_index = importlib.import_module(PACKAGE + ".lib.search_index")
+    search_index.INDEX_DIR = work_dir
+    cache.set_cache(cache.LocalDirCache(work_dir))
+    return pkg
+
+
+def peak_rss_mib() -> float | None:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / (2**20 if sys.platform == "darwin" else 2**10)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20
+    except (ImportError, AttributeError):
+        return None
+
+
+def environment() -> dict:
+    """Identify the tree and machine so results can be compared across commits."""
+    try:
+        commit = subprocess.run(
+            ["git", "-C", REPO_DIR, "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def write_results(results: dict, path: str | None):
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+def compare_results(current: dict, baseline_path: str, keys: list[str]):
+    """Print current vs. baseline for the given flat metric keys."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\n{'metric':<32}{'baseline':>14}{'current':>14}{'change':>10}")
+    for key in keys:
+        old, new = baseline.get("metrics", {}).get(key), current["metrics"].get(key)
+        if isinstance(old, (int, float)) and isinstance(new, (int, float)) and old:
+            change = f"{(new - old) / old * 100:+.1f}%"
+        else:
+            change = "n/a"
+        print(f"{key:<32}{_fmt(old):>14}{_fmt(new):>14}{change:>10}")
+
+
+def _fmt(v) -> str:
+    return "-" if v is None else f"{v:.3f}" if isinstance(v, float) else str(v)
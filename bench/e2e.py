@@ -0,0 +1,171 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# Offline end-to-end throughput benchmark.
+#
+#   calibre-debug -e bench/e2e.py -- --latency 0.08 --output e2e.json
+#   calibre-debug -e bench/e2e.py -- --compare e2e.json
+#
+# Starts a local fake of the MangaDex API/at-home/CDN and drives the real
+# search, detail page and volume build code paths against it.
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import _harness  # noqa: E402
+from fake_mangadex import FakeConfig, FakeMangaDex  # noqa: E402
+
+COMPARED_METRICS = [
+    "search_seconds", "detail_page_seconds", "time_to_first_page_seconds",
+    "build_seconds", "pages_per_second", "mib_per_second",
+    "event_loop_lag_p95_ms", "event_loop_lag_max_ms", "peak_rss_mib",
+]
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(
+        description="Offline end-to-end throughput benchmark against a fake MangaDex.")
+    p.add_argument("--latency", type=float, default=0.05, help="upstream latency in seconds")
+    p.add_argument("--jitter", type=float, default=0.02, help="+- latency jitter in seconds")
+    p.add_argument("--bandwidth", type=float, default=0,
+                   help="per-response image bandwidth in bytes/s (0 = unlimited)")
+    p.add_argument("--error-rate", type=float, default=0.0, help="HTTP 500 probability for pages")
+    p.add_argument("--corrupt-rate", type=float, default=0.0,
+                   help="probability of a truncated page body")
+    p.add_argument("--volumes", type=int, default=2, help="volumes to build")
+    p.add_argument("--chapters", type=int, default=8, help="chapters per volume")
+    p.add_argument("--pages", type=int, default=20, help="pages per chapter")
+    p.add_argument("--page-size", default="1000x1500", help="synthetic page size WxH")
+    p.add_argument("--workers", type=int, default=1, help="concurrent volume builds")
+    p.add_argument("--request-limit", type=int, default=6, help="concurrent upstream requests")
+    p.add_argument("--profile", default="original", help="transcode profile")
+    p.add_argument("--data-saver", action="store_true")
+    p.add_argument("--output", help="write results JSON here")
+    p.add_argument("--compare", help="baseline results JSON to compare against")
+    return p.parse_args(argv)
+
+
+async def _sample_loop_lag(samples: list[float], interval: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def run(args, fake: FakeMangaDex) -> dict:
+    from calibre_plugins.store_mangadex.req.search import search_for_manga_by_user_query_dict
+    from calibre_plugins.store_mangadex.req.manga_info import get_manga_info_page
+    from calibre_plugins.store_mangadex.req import scrape
+
+    lag: list[float] = []
+    lag_task = asyncio.create_task(_sample_loop_lag(lag))
+    metrics = {}
+
+    t = time.perf_counter()
+    results = await search_for_manga_by_user_query_dict("benchmark +tag", 20)
+    metrics["search_seconds"] = time.perf_counter() - t
+    metrics["search_results"] = len(results)
+
+    t = time.perf_counter()
+    await get_manga_info_page("manga-1")
+    metrics["detail_page_seconds"] = time.perf_counter() - t
+
+    bytes_before = fake.bytes_sent
+    t = time.perf_counter()
+    # task traces use the monotonic clock
+    build_start = time.monotonic()
+    task_ids = []
+    for v in range(1, args.volumes + 1):
+        names = [str((v - 1) * args.chapters + c + 1) for c in range(args.chapters)]
+        status = await scrape.get_mangadex_volume(
+            "bench", "manga-1", "en", str(v), json.dumps(names), 0,
+            args.data_saver, args.profile)
+        task_ids.append(status["task_id"])
+    while any(scrape.tasks_status[i][0] in ("scheduled", "running") for i in task_ids):
+        await asyncio.sleep(0.05)
+    build = time.perf_counter() - t
+    lag_task.cancel()
+
+    errors = {i: scrape.tasks_status[i][0] for i in task_ids
+              if scrape.tasks_status[i][0] != "completed"}
+    pages = 0
+    first_page = None
+    for i in task_ids:
+        trace = scrape.tasks_trace[i]
+        writes = [s for s in trace.spans if s.name == "zip_write" and s.end is not None]
+        pages += len(writes)
+        if writes:
+            first = min(s.end for s in writes) - build_start
+            first_page = first if first_page is None else min(first_page, first)
+    downloaded = fake.bytes_sent - bytes_before
+
+    metrics.update({
+        "build_seconds": build,
+        "pages": pages,
+        "pages_per_second": pages / build if build else None,
+        "mib_per_second": downloaded / 2**20 / build if build else None,
+        "time_to_first_page_seconds": first_page,
+        "event_loop_lag_p95_ms": (_harness.percentile(lag, 0.95) or 0) * 1000,
+        "event_loop_lag_max_ms": max(lag, default=0) * 1000,
+        "peak_rss_mib": _harness.peak_rss_mib(),
+        "upstream_requests": fake.requests,
+        "upstream_errors": fake.errors,
+        "failed_volumes": len(errors),
+    })
+    if errors:
+        metrics["errors"] = errors
+    return metrics
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    width, height = (int(x) for x in args.page_size.split("x"))
+    fake = FakeMangaDex(FakeConfig(
+        latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth,
+        error_rate=args.error_rate, corrupt_rate=args.corrupt_rate, volumes=args.volumes,
+        chapters_per_volume=args.chapters, pages_per_chapter=args.pages,
+        page_size=(width, height))).start()
+    try:
+        _harness.load_plugin()
+        from calibre_plugins.store_mangadex.lib import mangadex_api, utils
+        from calibre_plugins.store_mangadex.req import scrape
+        mangadex_api.MANGADEX_API_URL = fake.url
+        mangadex_api.MANGADEX_COVERS_URL = fake.url + "/covers"
+        utils.parallel_request_limit, utils.req_semaphore = args.request_limit, None
+        scrape.parallel_worker_limit, scrape.worker_semaphore = args.workers, None
+        metrics = asyncio.run(run(args, fake))
+    finally:
+        fake.stop()
+    results = {
+        "benchmark": "e2e",
+        "environment": _harness.environment(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "metrics": metrics,
+    }
+    _harness.write_results(results, args.output)
+    if args.compare:
+        _harness.compare_results(results, args.compare, COMPARED_METRICS)
+
+
+if __name__ == "__main__":
+    main()
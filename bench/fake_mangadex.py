@@ -0,0 +1,255 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+# Local stand-in for api.mangadex.org, the covers host and at-home nodes.
+# Everything is served from one port; latency, bandwidth and error rate
+# are configurable so the real plugin code paths can be benchmarked offline.
+
+
+class FakeConfig:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02,
+                 bandwidth: float = 0, error_rate: float = 0.0, corrupt_rate: float = 0.0,
+                 mangas: int = 20, volumes: int = 4, chapters_per_volume: int = 8,
+                 pages_per_chapter: int = 20, page_size: tuple[int, int] = (1000, 1500),
+                 seed: int = 1):
+        # seconds added to every response, +- uniform jitter
+        self.latency = latency
+        self.jitter = jitter
+        # bytes/s per response for images, 0 = unlimited
+        self.bandwidth = bandwidth
+        # probability of an HTTP 500 on image requests
+        self.error_rate = error_rate
+        # probability of a truncated image body (with a matching Content-Length)
+        self.corrupt_rate = corrupt_rate
+        self.mangas = mangas
+        self.volumes = volumes
+        self.chapters_per_volume = chapters_per_volume
+        self.pages_per_chapter = pages_per_chapter
+        self.page_size = page_size
+        self.seed = seed
+
+
+def _synthetic_page(size: tuple[int, int], fmt: str, seed: int) -> bytes:
+    """Noisy grayscale-ish page so encoded sizes resemble real scans."""
+    rnd = random.Random(seed)
+    small = Image.new("L", (size[0] // 8, size[1] // 8))
+    small.putdata([rnd.randrange(256) for _ in range(small.width * small.height)])
+    img = small.resize(size, Image.Resampling.BILINEAR).convert("RGB")
+    with io.BytesIO() as out:
+        if fmt == "JPEG":
+            img.save(out, fmt, quality=85)
+        else:
+            img.save(out, fmt)
+        return out.getvalue()
+
+
+class FakeMangaDex:
+    def __init__(self, config: FakeConfig | None = None):
+        self.config = config or FakeConfig()
+        self.pages = {
+            "jpg": _synthetic_page(self.config.page_size, "JPEG", self.config.seed),
+            "png": _synthetic_page(self.config.page_size, "PNG", self.config.seed + 1),
+        }
+        small = (self.config.page_size[0] // 2, self.config.page_size[1] // 2)
+        self.saver_page = _synthetic_page(small, "JPEG", self.config.seed + 2)
+        self.cover = _synthetic_page((256, 364), "JPEG", self.config.seed + 3)
+        # full-quality file names carry the SHA-256 of the file, like MangaDex
+        self.page_hashes = {ext: hashlib.sha256(data).hexdigest()
+                            for ext, data in self.pages.items()}
+        self.requests = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.httpd = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self) -> "FakeMangaDex":
+        fake = self
+
+        class Handler(_FakeHandler):
+            server_state = fake
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def _count(self, nbytes: int, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += nbytes
+            self.errors += int(error)
+
+    # –– API payloads ––
+
+    def manga_json(self, i: int) -> dict:
+        return {
+            "id": f"manga-{i}",
+            "type": "manga",
+            "attributes": {
+                "title": {"en": f"Benchmark Manga {i}"},
+                "altTitles": [{"ja": f"ベンチマーク {i}"}, {"en": f"Bench {i}"}],
+                "description": {"en": "Synthetic series for benchmarks. " * 8},
+                "year": 2000 + i % 25,
+                "contentRating": "safe",
+                "availableTranslatedLanguages": ["en", "es"],
+                "tags": [{"id": f"tag-{t}", "attributes": {"name": {"en": f"Tag {t}"}}}
+                         for t in range(i % 5, i % 5 + 6)],
+            },
+            "relationships": [
+                {"id": f"author-{i}", "type": "author", "attributes": {"name": f"Author {i}"}},
+                {"id": f"artist-{i}", "type": "artist", "attributes": {"name": f"Artist {i}"}},
+                {"id": f"cover-{i}", "type": "cover_art", "attributes": {"fileName": f"cover-{i}.jpg"}},
+            ],
+        }
+
+    def chapters(self) -> list[tuple[str, str]]:
+        """(volume, chapter name) of every chapter, in reading order."""
+        c = self.config
+        return [(str(v), str((v - 1) * c.chapters_per_volume + ch + 1))
+                for v in range(1, c.volumes + 1) for ch in range(c.chapters_per_volume)]
+
+    def aggregate_json(self) -> dict:
+        c = self.config
+        volumes = {}
+        for volume, name in self.chapters():
+            vol = volumes.setdefault(volume, {"volume": volume, "count": 0, "chapters": {}})
+            vol["chapters"][name] = {"chapter": name, "id": f"chapter-{name}", "others": [], "count": 1}
+            vol["count"] += 1
+        return {"result": "ok", "volumes": volumes}
+
+    def feed_json(self, qs: dict) -> dict:
+        # chapter n was last updated n minutes after 2025-01-01 00:00 UTC
+        since = qs.get("updatedAtSince", [""])[0]
+        chapters = []
+        for volume, name in self.chapters():
+            n = int(name)
+            updated = f"2025-01-01T{n // 60:02d}:{n % 60:02d}:00"
+            if updated >= since:
+                chapters.append({"id": f"chapter-{name}", "type": "chapter", "attributes": {
+                    "volume": volume, "chapter": name, "translatedLanguage": "en",
+                    "pages": self.config.pages_per_chapter,
+                    "updatedAt": updated + "+00:00"}})
+        offset = int(qs.get("offset", ["0"])[0])
+        limit = int(qs.get("limit", ["100"])[0])
+        return {"result": "ok", "data": chapters[offset:offset + limit],
+                "total": len(chapters)}
+
+    def at_home_json(self, chapter_id: str) -> dict:
+        n = self.config.pages_per_chapter
+        # mostly JPEG with an occasional PNG, like real uploads
+        exts = ['png' if i % 7 == 6 else 'jpg' for i in range(n)]
+        return {
+            "result": "ok",
+            "baseUrl": self.url,
+            "chapter": {"hash": f"hash-{chapter_id}",
+                        "data": [f"{i + 1}-{self.page_hashes[e]}.{e}" for i, e in enumerate(exts)],
+                        "dataSaver": [f"{i + 1}-{chapter_id}.jpg" for i in range(n)]},
+        }
+
+    def tags_json(self) -> dict:
+        return {"result": "ok", "data": [
+            {"id": f"tag-{t}", "type": "tag", "attributes": {"name": {"en": f"Tag {t}"}}}
+            for t in range(40)]}
+
+    def search_json(self, qs: dict) -> dict:
+        limit = int(qs.get("limit", ["10"])[0])
+        if "ids[]" in qs:
+            mangas = [self.manga_json(int(m.rsplit("-", 1)[-1])) for m in qs["ids[]"][:limit]]
+        else:
+            mangas = [self.manga_json(i) for i in range(min(limit, self.config.mangas))]
+        last = f"chapter-{self.chapters()[-1][1]}" if self.chapters() else None
+        for m in mangas:
+            m["attributes"]["latestUploadedChapter"] = last
+        return {"result": "ok", "data": mangas}
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    server_state: FakeMangaDex = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server_state
+        c = fake.config
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        time.sleep(max(0.0, c.latency + random.uniform(-c.jitter, c.jitter)))
+        if parts[:1] in (["data"], ["data-saver"]) and len(parts) == 3:
+            if random.random() < c.error_rate:
+                return self._send(500, b"", "text/plain", error=True)
+            if parts[0] == "data-saver":
+                body = fake.saver_page
+            else:
+                body = fake.pages["png" if parts[2].endswith(".png") else "jpg"]
+            if random.random() < c.corrupt_rate:
+                body = body[:len(body) // 2]
+            return self._send(200, body, "image/jpeg", throttle=True)
+        if parts[:1] == ["covers"]:
+            return self._send(200, fake.cover, "image/jpeg", throttle=True)
+        if parts == ["manga", "tag"]:
+            return self._json(fake.tags_json())
+        if parts == ["manga"]:
+            return self._json(fake.search_json(parse_qs(url.query)))
+        if len(parts) == 3 and parts[0] == "manga" and parts[2] == "aggregate":
+            return self._json(fake.aggregate_json())
+        if len(parts) == 3 and parts[0] == "manga" and parts[2] == "feed":
+            return self._json(fake.feed_json(parse_qs(url.query)))
+        if len(parts) == 2 and parts[0] == "manga":
+            i = int(parts[1].rsplit("-", 1)[-1]) if parts[1].rsplit("-", 1)[-1].isdigit() else 0
+            return self._json({"result": "ok", "data": fake.manga_json(i)})
+        if len(parts) == 3 and parts[:2] == ["at-home", "server"]:
+            return self._json(fake.at_home_json(parts[2]))
+        self._send(404, b"", "text/plain")
+
+    def _json(self, obj):
+        self._send(200, json.dumps(obj).encode("utf-8"), "application/json")
+
+    def _send(self, code, body: bytes, ctype: str, throttle=False, error=False):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        bandwidth = self.server_state.config.bandwidth
+        if throttle and bandwidth > 0:
+            chunk = max(1024, int(bandwidth / 20))
+            for i in range(0, len(body), chunk):
+                self.wfile.write(body[i:i + chunk])
+                time.sleep(len(body[i:i + chunk]) / bandwidth)
+        else:
+            self.wfile.write(body)
+        self.server_state._count(len(body), error)
@@ -0,0 +1,158 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# Micro-benchmarks for the CPU-bound hot paths, with a regression gate.
+#
+#   calibre-debug -e bench/micro.py -- --record micro-baseline.json
+#   calibre-debug -e bench/micro.py -- --baseline micro-baseline.json --threshold 0.15
+#
+# With --baseline the run exits with status 1 when any case got slower than
+# the recorded time by more than --threshold (a fraction).
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import _harness  # noqa: E402
+from fake_mangadex import FakeConfig, FakeMangaDex, _synthetic_page  # noqa: E402
+
+
+def measure(fn, repeat: int, min_time: float) -> float:
+    """Best-of-`repeat` seconds per call, each round running for at least `min_time`."""
+    fn()
+    best = float("inf")
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / calls)
+    return best
+
+
+def build_cases(quick: bool) -> dict:
+    from calibre_plugins.store_mangadex.model.mangadex import MangaInfo, VolumeInfo
+    from calibre_plugins.store_mangadex.req.search import _normalize_title, _normalize_tag
+    from calibre_plugins.store_mangadex.lib.utils import resize_jpeg_bytes
+    from calibre_plugins.store_mangadex.lib.transcode import (
+        TRANSCODE_PROFILES, DEFAULT_PROFILE, transcode_page)
+    from calibre.utils.zipfile import ZipFile
+
+    fake = FakeMangaDex(FakeConfig(volumes=1, chapters_per_volume=2000, page_size=(200, 300)))
+    manga = fake.manga_json(7)
+    # large payload: many tags, alt titles and relationships
+    manga["attributes"]["tags"] *= 10
+    manga["attributes"]["altTitles"] = [{"ja": f"t{i}"} for i in range(60)] + [{"en": "Alt"}]
+    manga["relationships"] += [
+        {"id": f"a{i}", "type": "author", "attributes": {"name": f"Author {i}"}} for i in range(40)]
+    search_page = [manga] * 100
+    aggregate = fake.aggregate_json()["volumes"]["1"]
+    titles = [f"Shingeki no Kyojin × Attack on Titan ～ 第{i}話  edition" for i in range(500)]
+    tags = [f"Boys' Love / Sci-Fi #{i}" for i in range(500)]
+
+    sizes = [(800, 1200), (1600, 1100)] if quick else [(800, 1200), (1600, 1100), (1400, 2100), (2800, 2000)]
+    images = {
+        f"{fmt.lower()}_{w}x{h}": _synthetic_page((w, h), fmt, w + h)
+        for (w, h) in sizes for fmt in ("JPEG", "PNG")
+    }
+    cover = _synthetic_page((256, 364), "JPEG", 3)
+
+    def zip_writestr(pages=images["jpeg_800x1200"]):
+        with tempfile.TemporaryFile() as f, ZipFile(f, mode="w") as z:
+            for i in range(50):
+                z.writestr(f"{i:04d}.jpg", pages)
+
+    cases = {
+        "manga_info_100x": lambda: [MangaInfo(m).to_dict() for m in search_page],
+        "volume_from_api_2000ch": lambda: VolumeInfo.from_api(aggregate),
+        "normalize_title_500x": lambda: [_normalize_title(t) for t in titles],
+        "normalize_tag_500x": lambda: [_normalize_tag(t) for t in tags],
+        "resize_jpeg_bytes_cover": lambda: resize_jpeg_bytes(cover),
+        "zip_writestr_50_pages": zip_writestr,
+    }
+    for name, data in images.items():
+        # the default profile only rotates landscape pages
+        cases[f"transcode_original_{name}"] = \
+            lambda data=data: transcode_page(data, TRANSCODE_PROFILES[DEFAULT_PROFILE])
+        cases[f"transcode_eink6_{name}"] = \
+            lambda data=data: transcode_page(data, TRANSCODE_PROFILES["eink6"])
+    return cases
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Micro-benchmarks for CPU-bound hot paths.")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--min-time", type=float, default=0.2, help="seconds per round")
+    p.add_argument("--quick", action="store_true", help="fewer image sizes")
+    p.add_argument("--filter", default="", help="only run cases containing this text")
+    p.add_argument("--record", help="write results as a new baseline")
+    p.add_argument("--baseline", help="compare against this baseline")
+    p.add_argument("--threshold", type=float, default=0.15,
+                   help="allowed slowdown vs. baseline, as a fraction")
+    args = p.parse_args(sys.argv[1:] if argv is None else argv)
+
+    _harness.load_plugin()
+    cases = build_cases(args.quick)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["metrics"]
+
+    metrics = {}
+    regressions = []
+    print(f"{'case':<44}{'time':>12}{'baseline':>12}{'change':>10}")
+    for name, fn in cases.items():
+        if args.filter not in name:
+            continue
+        seconds = measure(fn, args.repeat, args.min_time)
+        metrics[name] = seconds
+        old = baseline.get(name)
+        change = ""
+        if old:
+            ratio = (seconds - old) / old
+            change = f"{ratio * 100:+.1f}%"
+            if ratio > args.threshold:
+                regressions.append(name)
+                change += " !"
+        print(f"{name:<44}{_ms(seconds):>12}{_ms(old):>12}{change:>10}")
+
+    if args.record:
+        _harness.write_results({
+            "benchmark": "micro",
+            "environment": _harness.environment(),
+            "metrics": metrics,
+        }, args.record)
+    if regressions:
+        print(f"\n{len(regressions)} case(s) regressed more than "
+              f"{args.threshold * 100:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def _ms(seconds) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.3f}ms"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+
+from .lib import utils
+from .lib.mangadex_api import get_manga_info
+from .lib.metrics import PAGES_DOWNLOADED, UPSTREAM_BYTES
+from .lib.transcode import TRANSCODE_PROFILES, DEFAULT_PROFILE
+from .req import scrape
+from .req.shards import shutdown_pool
+from .req.manga_info import file_prefix, get_volume_plan
+
+# Headless batch builds, run through calibre:
+#
+#   calibre-debug -r MangaDex -- manifest.json --output ~/cbz --workers 2
+#
+# The manifest lists series and the volumes to build:
+#
+#   {
+#     "defaults": {"languages": ["en"], "data_saver": false, "profile": "original"},
+#     "series": [
+#       {"manga_id": "...", "volumes": ["1", "2"]},
+#       {"manga_id": "...", "languages": ["es"], "volumes": "all"}
+#     ]
+#   }
+
+USAGE = "calibre-debug -r MangaDex -- MANIFEST [options]"
+
+
+class Job:
+    def __init__(self, manga_id: str, prefix: str, language: str, volume_name: str,
+                 part: int, chapter_names: list[str], data_saver: bool, profile: str):
+        self.manga_id = manga_id
+        self.prefix = prefix
+        self.language = language
+        self.volume_name = volume_name
+        self.part = part
+        self.chapter_names = chapter_names
+        self.data_saver = data_saver
+        self.profile = profile
+        self.task_id = None
+        self.status = "pending"
+        self.finished = False
+        self.file_name = scrape.get_file_name(
+            prefix, volume_name, part, language, manga_id, data_saver, profile)
+
+    def to_dict(self) -> dict:
+        return {
+            "type": "job",
+            "manga_id": self.manga_id,
+            "language": self.language,
+            "volume": self.volume_name,
+            "part": self.part,
+            "chapters": len(self.chapter_names),
+            "task_id": self.task_id,
+            "status": self.status,
+            "file_name": self.file_name,
+        }
+
+
+def parse_args(argv: list[str]):
+    p = argparse.ArgumentParser(
+        prog="mangadex", usage=USAGE,
+        description="Build MangaDex CBZs from a manifest without the calibre GUI.")
+    p.add_argument("manifest", help="JSON manifest of series, languages and volumes")
+    p.add_argument("--output", "-o", default=".", help="directory for the CBZ files")
+    p.add_argument("--workers", type=int, default=scrape.parallel_worker_limit,
+                   help="volumes built concurrently")
+    p.add_argument("--requests", type=int, default=utils.parallel_request_limit,
+                   help="concurrent upstream requests")
+    p.add_argument("--processes", type=int, default=scrape.shard_processes,
+                   help="spread builds over this many worker processes (0 = in-process)")
+    p.add_argument("--skip-existing", action="store_true",
+                   help="do not rebuild CBZs already in the output directory")
+    p.add_argument("--dry-run", action="store_true",
+                   help="only list the volumes that would be built")
+    p.add_argument("--interval", type=float, default=2.0, help="seconds between progress lines")
+    return p.parse_args(argv)
+
+
+async def plan_jobs(manifest: dict) -> list[Job]:
+    """Expand the manifest into one job per volume part."""
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for series in manifest["series"]:
+        opts = {**defaults, **series}
+        profile = opts.get("profile", DEFAULT_PROFILE)
+        if profile not in TRANSCODE_PROFILES:
+            raise ValueError(f"unknown transcode profile: {profile}")
+        manga_id = opts["manga_id"]
+        info = await get_manga_info(manga_id)
+        prefix = opts.get("prefix") or file_prefix(info.title)
+        wanted = opts.get("volumes", "all")
+        for lang in opts.get("languages", ["en"]):
+            plan = await get_volume_plan(manga_id, lang)
+            if wanted != "all":
+                names = {str(v) for v in wanted}
+                plan = {name: parts for name, parts in plan.items() if name in names}
+            for volume_name, parts in plan.items():
+                for p in parts:
+                    jobs.append(Job(
+                        manga_id, prefix, lang, volume_name, p["part"], p["chapters"],
+                        bool(opts.get("data_saver", False)), profile))
+    return jobs
+
+
+def _progress_line(jobs: list[Job], started: float, pages_start: float) -> str:
+    done = sum(j.status == "completed" for j in jobs)
+    failed = sum(j.status.startswith("error") for j in jobs)
+    running = [j for j in jobs if j.status == "running"]
+    pages = PAGES_DOWNLOADED.values.get((), 0) - pages_start
+    elapsed = time.monotonic() - started
+    current = ", ".join(
+        f"{j.manga_id[:8]} v{j.volume_name}{'.' + str(j.part) if j.part else ''} "
+        f"{scrape.tasks_status.get(j.task_id, ('', ''))[1]}" for j in running)
+    return (f"[{done + failed}/{len(jobs)}] {pages:.0f} pages, "
+            f"{pages / max(elapsed, 1e-6):.1f} pages/s"
+            + (f" | {current}" if current else ""))
+
+
+async def run_jobs(jobs: list[Job], output: str, interval: float) -> dict:
+    os.makedirs(output, exist_ok=True)
+    started = time.monotonic()
+    pages_start = PAGES_DOWNLOADED.values.get((), 0)
+    bytes_start = sum(UPSTREAM_BYTES.values.values())
+    for job in jobs:
+        status = await scrape.get_mangadex_volume(
+            job.prefix, job.manga_id, job.language, job.volume_name,
+            json.dumps(job.chapter_names), job.part, job.data_saver, job.profile)
+        job.task_id = status["task_id"]
+    # the worker semaphore limits how many of these run at once
+    last_print = 0.0
+    while True:
+        pending = False
+        for job in jobs:
+            if job.finished:
+                continue
+            job.status = scrape.tasks_status.get(job.task_id, ("unknown task", ""))[0]
+            if job.status in ("scheduled", "running"):
+                pending = True
+                continue
+            job.finished = True
+            if job.status == "completed":
+                # copied, the cached file stays a hit for later builds
+                path, _ = scrape.get_cbz_file_path(job.task_id)
+                shutil.copyfile(path, os.path.join(output, job.file_name))
+                print(f"done   {job.file_name}")
+            else:
+                print(f"failed {job.file_name}: {job.status}")
+        now = time.monotonic()
+        if not pending:
+            break
+        if now - last_print >= interval:
+            print(_progress_line(jobs, started, pages_start))
+            last_print = now
+        await asyncio.sleep(0.25)
+
+    seconds = time.monotonic() - started
+    pages = PAGES_DOWNLOADED.values.get((), 0) - pages_start
+    downloaded = sum(UPSTREAM_BYTES.values.values()) - bytes_start
+    written = sum(
+        os.path.getsize(os.path.join(output, j.file_name))
+        for j in jobs if j.status == "completed")
+    return {
+        "volumes": len(jobs),
+        "completed": sum(j.status == "completed" for j in jobs),
+        "failed": [j.to_dict() for j in jobs if j.status != "completed"],
+        "pages": int(pages),
+        "seconds": round(seconds, 3),
+        "pages_per_second": round(pages / seconds, 2) if seconds else None,
+        "downloaded_mib": round(downloaded / 2**20, 2),
+        "mib_per_second": round(downloaded / 2**20 / seconds, 2) if seconds else None,
+        "written_mib": round(written / 2**20, 2),
+    }
+
+
+async def _main(args) -> int:
+    with open(args.manifest, encoding="utf-8") as f:
+        manifest = json.load(f)
+    jobs = await plan_jobs(manifest)
+    if args.skip_existing:
+        jobs = [j for j in jobs if not os.path.exists(os.path.join(args.output, j.file_name))]
+    processes = f" in each of {args.processes} processes" if args.processes else ""
+    print(f"{len(jobs)} volume(s) to build with {args.workers} worker(s){processes}, "
+          f"{args.requests} concurrent request(s)")
+    if args.dry_run:
+        for job in jobs:
+            print(f"  {job.file_name} ({len(job.chapter_names)} chapters)")
+        return 0
+    try:
+        summary = await run_jobs(jobs, args.output, args.interval)
+    finally:
+        shutdown_pool()
+    print(f"\n{summary['completed']}/{summary['volumes']} volumes, {summary['pages']} pages "
+          f"in {summary['seconds']:.1f}s: {summary['pages_per_second']} pages/s, "
+          f"{summary['mib_per_second']} MiB/s downloaded, "
+          f"{summary['written_mib']} MiB written to {args.output}")
+    return 1 if summary["failed"] else 0
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    # the semaphores are created lazily on first use, so set the limits first
+    scrape.parallel_worker_limit, scrape.worker_semaphore = args.workers, None
+    scrape.shard_processes = args.processes
+    utils.parallel_request_limit, utils.req_semaphore = args.requests, None
+    try:
+        return asyncio.run(_main(args))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
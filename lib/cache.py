@@ -0,0 +1,425 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from functools import partial
+from .events import get_logger
+from .utils import delete_files_older_than
+from calibre.utils.config import config_dir
+
+log = get_logger(__name__)
+
+# Thumbnails, raw pages and built CBZs go through one cache interface. Each
+# cache is a namespace (a subdirectory of the cache root) of files addressed
+# by key. Two backends:
+#
+# - LocalDirCache: the plugin config dir, as before.
+# - SharedDirCache: a directory several calibre instances share (e.g. on a
+#   NAS), set with MANGADEX_SHARED_CACHE. Lookups go through a per-namespace
+#   append-only manifest instead of listing or stat-ing the share, and raw
+#   pages are cached too so one instance's download is everyone's hit.
+#
+# Both publish atomically (write to a temp file in the namespace, then
+# rename) and take lock files for expensive entries (CBZ builds), so two
+# processes never build the same file at once.
+#
+# The backends are blocking and also used from HTTP handler threads; code on
+# the event loop goes through run_io(), since a lookup on a NAS can take a
+# round trip or more.
+
+PLUGIN_ID = 'MangaDex'
+THUMBNAIL_CACHE = 'thumbnail_cache'
+PAGE_CACHE = 'page_cache'
+CBZ_CACHE = 'cbz_cache'
+
+# hours an entry is kept; None keeps it forever
+cache_hours = {THUMBNAIL_CACHE: None, PAGE_CACHE: 12, CBZ_CACHE: 12}
+purge_interval = 3600
+# a lock file not refreshed for this long belongs to a dead process
+lock_stale_seconds = 120
+lock_heartbeat_seconds = 30
+lock_poll_seconds = 0.5
+
+_TMP_DIR = '.tmp'
+_LOCK_DIR = '.locks'
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+async def run_io(fn, *args):
+    """Run a blocking cache call on the default executor, off the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+class _FileLock:
+    """Lock file created with O_EXCL, which also works on network shares."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.token = uuid.uuid4().hex
+
+    def _owner(self, path: str) -> str | None:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def try_acquire(self) -> bool:
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            owner = self._owner(self.path)
+            try:
+                age = time.time() - os.path.getmtime(self.path)
+            except FileNotFoundError:
+                return False
+            if owner is None or age <= lock_stale_seconds:
+                return False
+            log.warning("cache_lock_stale", path=self.path, age=round(age))
+            # only the process that broke the lock may take it
+            return self._break(owner) and self.try_acquire()
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps({"host": socket.gethostname(), "pid": os.getpid(),
+                                "token": self.token}))
+        return True
+
+    def _break(self, owner: str) -> bool:
+        """
+        Move the stale lock aside under a unique name. The rename succeeds
+        for one of several processes breaking it at once; that one checks it
+        moved the lock it judged stale and not a new one taken meanwhile.
+        """
+        aside = f"{self.path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            return False
+        moved = self._owner(aside)
+        if moved != owner:
+            # broken and taken again since we looked: give it back
+            try:
+                os.link(aside, self.path)
+            except OSError:
+                pass
+        try:
+            os.remove(aside)
+        except FileNotFoundError:
+            pass
+        return moved == owner
+
+    def touch(self):
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            pass
+
+    def release(self):
+        # a lock held past lock_stale_seconds may already belong to someone else
+        owner = self._owner(self.path)
+        if owner is None or self.token not in owner:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class LocalDirCache:
+    type = "local"
+    # raw pages are only worth keeping locally when asked for
+    cache_pages = os.environ.get('MANGADEX_PAGE_CACHE', '0') in ('1', 'true')
+
+    def __init__(self, root: str):
+        self.root = root
+        self._last_purge: dict[str, float] = {}
+
+    def to_spec(self) -> dict:
+        """Enough to recreate this backend in a worker process."""
+        return {"type": self.type, "root": self.root}
+
+    def _dir(self, namespace: str, *sub: str) -> str:
+        return os.path.join(self.root, namespace, *sub)
+
+    def path(self, namespace: str, key: str) -> str:
+        return self._dir(namespace, key)
+
+    def find(self, namespace: str, key: str) -> str | None:
+        """Path of the entry if it is cached."""
+        path = self.path(namespace, key)
+        return path if os.path.isfile(path) else None
+
+    def get(self, namespace: str, key: str) -> bytes | None:
+        try:
+            with open(self.path(namespace, key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def keys(self, namespace: str) -> list[str]:
+        try:
+            return [e.name for e in os.scandir(self._dir(namespace))
+                    if e.is_file() and e.name != MANIFEST_NAME]
+        except FileNotFoundError:
+            return []
+
+    def new_file(self, namespace: str) -> str:
+        """A temp path on the same file system, to be published or discarded."""
+        tmp_dir = self._dir(namespace, _TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, f"{socket.gethostname()}.{os.getpid()}.{uuid.uuid4().hex}")
+
+    def publish(self, namespace: str, key: str, tmp_path: str):
+        os.replace(tmp_path, self.path(namespace, key))
+
+    def discard(self, tmp_path: str):
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def put(self, namespace: str, key: str, data: bytes):
+        tmp_path = self.new_file(namespace)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            self.publish(namespace, key, tmp_path)
+        except BaseException:
+            self.discard(tmp_path)
+            raise
+
+    @asynccontextmanager
+    async def lock(self, namespace: str, key: str):
+        """
+        Hold the lock for `key` across processes. Yields True if another
+        process held it first, so the caller should look for its result.
+        """
+        lock_dir = self._dir(namespace, _LOCK_DIR)
+        await run_io(partial(os.makedirs, lock_dir, exist_ok=True))
+        lock = _FileLock(os.path.join(lock_dir, key + ".lock"))
+        waited = False
+        while not await run_io(lock.try_acquire):
+            waited = True
+            await asyncio.sleep(lock_poll_seconds)
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(lock_heartbeat_seconds)
+                await run_io(lock.touch)
+        task = asyncio.create_task(heartbeat())
+        try:
+            yield waited
+        finally:
+            task.cancel()
+            await run_io(lock.release)
+
+    def purge(self, namespace: str):
+        """Drop expired entries, at most once per purge_interval."""
+        hours = cache_hours.get(namespace)
+        now = time.monotonic()
+        if hours is None or now - self._last_purge.get(namespace, -purge_interval) < purge_interval:
+            return
+        self._last_purge[namespace] = now
+        if os.path.isdir(self._dir(namespace)):
+            delete_files_older_than(self._dir(namespace), hours=hours)
+            # temp files of builds that died half way
+            if os.path.isdir(self._dir(namespace, _TMP_DIR)):
+                delete_files_older_than(self._dir(namespace, _TMP_DIR), hours=hours)
+
+
+class _Manifest:
+    """In-memory view of a namespace manifest, read incrementally."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._ino = None
+        self._offset = 0
+        # used from executor and HTTP handler threads at once; reentrant so
+        # a purge can hold it across refresh() and append()
+        self.lock = threading.RLock()
+
+    def refresh(self):
+        with self.lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self.entries, self._ino, self._offset = {}, None, 0
+                return
+            if st.st_ino != self._ino or st.st_size < self._offset:
+                # rewritten by a purge
+                self.entries, self._ino, self._offset = {}, st.st_ino, 0
+            if st.st_size == self._offset:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+            # a line still being appended is read next time
+            end = data.rfind(b"\n") + 1
+            self._offset += end
+            for entry in _parse_lines(data[:end]):
+                self.entries[entry["key"]] = entry
+
+    def snapshot(self) -> dict[str, dict]:
+        with self.lock:
+            return dict(self.entries)
+
+    def append(self, entry: dict):
+        # one small O_APPEND write per entry, no lock file needed
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        while True:
+            fd = os.open(self.path, os.O_CREAT | os.O_APPEND | os.O_WRONLY)
+            try:
+                os.write(fd, line)
+                ino = os.fstat(fd).st_ino
+            finally:
+                os.close(fd)
+            # A purge that replaced the manifest before we checked carries over
+            # what reached the old file by then; if it replaced it under us,
+            # the entry may be lost, so write it again (a duplicate is harmless).
+            try:
+                if os.stat(self.path).st_ino == ino:
+                    break
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            self.entries[entry["key"]] = entry
+
+
+def _parse_lines(data: bytes) -> list[dict]:
+    entries = []
+    for line in data.splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+class SharedDirCache(LocalDirCache):
+    type = "shared"
+    cache_pages = os.environ.get('MANGADEX_PAGE_CACHE', '1') in ('1', 'true')
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self._manifests: dict[str, _Manifest] = {}
+
+    def _manifest(self, namespace: str) -> _Manifest:
+        manifest = self._manifests.get(namespace)
+        if manifest is None:
+            manifest = self._manifests.setdefault(
+                namespace, _Manifest(self._dir(namespace, MANIFEST_NAME)))
+        manifest.refresh()
+        return manifest
+
+    def find(self, namespace: str, key: str) -> str | None:
+        # a manifest miss is a miss; the share itself is not listed
+        if key not in self._manifest(namespace).entries:
+            return None
+        return super().find(namespace, key)
+
+    def get(self, namespace: str, key: str) -> bytes | None:
+        if key not in self._manifest(namespace).entries:
+            return None
+        return super().get(namespace, key)
+
+    def keys(self, namespace: str) -> list[str]:
+        return list(self._manifest(namespace).snapshot())
+
+    def publish(self, namespace: str, key: str, tmp_path: str):
+        size = os.path.getsize(tmp_path)
+        super().publish(namespace, key, tmp_path)
+        self._manifest(namespace).append({
+            "key": key, "size": size, "time": time.time(),
+            "host": socket.gethostname()})
+
+    def purge(self, namespace: str):
+        hours = cache_hours.get(namespace)
+        now = time.monotonic()
+        if hours is None or now - self._last_purge.get(namespace, -purge_interval) < purge_interval:
+            return
+        self._last_purge[namespace] = now
+        lock = _FileLock(self._dir(namespace, _LOCK_DIR, "purge.lock"))
+        os.makedirs(os.path.dirname(lock.path), exist_ok=True)
+        if not lock.try_acquire():
+            # another instance is purging
+            return
+        try:
+            manifest = self._manifest(namespace)
+            cutoff = time.time() - hours * 3600
+            expired = [k for k, e in manifest.snapshot().items() if e["time"] < cutoff]
+            for key in expired:
+                try:
+                    os.remove(self.path(namespace, key))
+                except FileNotFoundError:
+                    pass
+            expired = set(expired)
+            if not os.path.isfile(manifest.path):
+                return
+            # no other thread may refresh (and move _offset) until the late
+            # entries are carried over
+            with manifest.lock, open(manifest.path, "rb") as old:
+                # pick up entries appended meanwhile, then rewrite the manifest
+                manifest.refresh()
+                keep = [e for k, e in manifest.entries.items() if k not in expired]
+                tmp_path = self.new_file(namespace)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.writelines(json.dumps(e) + "\n" for e in keep)
+                os.replace(tmp_path, manifest.path)
+                # publishes that reached the old file after the refresh
+                old.seek(manifest._offset)
+                late = _parse_lines(old.read())
+                manifest.refresh()
+                for entry in late:
+                    manifest.append(entry)
+            log.info("cache_purged", namespace=namespace, removed=len(expired), kept=len(keep))
+            if os.path.isdir(self._dir(namespace, _TMP_DIR)):
+                delete_files_older_than(self._dir(namespace, _TMP_DIR), hours=hours)
+        finally:
+            lock.release()
+
+
+_BACKENDS = {"local": LocalDirCache, "shared": SharedDirCache}
+_cache: LocalDirCache | None = None
+
+
+def from_spec(spec: dict) -> LocalDirCache:
+    return _BACKENDS[spec["type"]](spec["root"])
+
+
+def get_cache() -> LocalDirCache:
+    """The configured backend, from MANGADEX_SHARED_CACHE on first use."""
+    global _cache
+    if _cache is None:
+        shared = os.environ.get('MANGADEX_SHARED_CACHE')
+        if shared:
+            _cache = SharedDirCache(shared)
+        else:
+            _cache = LocalDirCache(os.path.join(config_dir, 'plugins', PLUGIN_ID))
+        log.info("cache_backend", type=_cache.type, root=_cache.root)
+    return _cache
+
+
+def set_cache(cache: LocalDirCache):
+    global _cache
+    _cache = cache
@@ -0,0 +1,194 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# On-demand diagnostics for a running calibre process. Only one profiling
+# session can be active at a time; the server exposes these under /debug/.
+
+_lock = threading.Lock()
+_session: "ProfilingSession | None" = None
+# From Python 3.12 cProfile sits on sys.monitoring, which is process-wide:
+# the profiler enabled for the event loop already sees every thread, and a
+# second one cannot be enabled while it runs.
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+
+class ProfilingSession:
+    """
+    "cprofile" mode runs a deterministic profiler on the event loop thread
+    and on every HTTP handler thread served while the session is open (one
+    process-wide profiler on Python 3.12+).
+    "sampling" mode periodically samples the stacks of all threads, which
+    also covers executor threads (downloads, image processing) at low cost.
+    """
+
+    def __init__(self, mode: str, loop: asyncio.AbstractEventLoop, interval: float):
+        self.mode = mode
+        self.loop = loop
+        self.interval = interval
+        self.started = time.monotonic()
+        self.profiles: list[cProfile.Profile] = []
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self._loop_profile = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        if self.mode == "cprofile":
+            self._loop_profile = cProfile.Profile()
+            self.loop.call_soon_threadsafe(self._loop_profile.enable)
+        else:
+            self._sampler = threading.Thread(
+                target=self._sample, name="mangadex-sampler", daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def add_profile(self, profile: cProfile.Profile):
+        with _lock:
+            self.profiles.append(profile)
+
+    def stop(self, limit: int = 60) -> str:
+        elapsed = time.monotonic() - self.started
+        if self.mode == "cprofile":
+            done = threading.Event()
+
+            def disable():
+                self._loop_profile.disable()
+                done.set()
+            self.loop.call_soon_threadsafe(disable)
+            done.wait(5)
+            out = io.StringIO()
+            stats = pstats.Stats(self._loop_profile, stream=out)
+            for p in self.profiles:
+                stats.add(p)
+            threads = ("all threads" if PROCESS_WIDE_PROFILER
+                       else f"event loop + {len(self.profiles)} handler threads")
+            out.write(f"cProfile session, {elapsed:.1f}s, {threads}\n")
+            stats.sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+        self._stop.set()
+        self._sampler.join()
+        # folded stacks, usable directly with flamegraph.pl / speedscope
+        header = (f"# sampling session, {elapsed:.1f}s, "
+                  f"{self.sample_count} samples every {self.interval * 1000:.0f}ms\n")
+        return header + "\n".join(
+            f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+def start_profiling(loop: asyncio.AbstractEventLoop, mode: str = "sampling",
+                    interval: float = 0.01) -> str:
+    global _session
+    if mode not in ("sampling", "cprofile"):
+        raise ValueError(f"unknown profiling mode: {mode}")
+    with _lock:
+        if _session is not None:
+            raise RuntimeError("a profiling session is already running")
+        _session = ProfilingSession(mode, loop, interval)
+    _session.start()
+    return f"{mode} profiling started"
+
+
+def stop_profiling(limit: int = 60) -> str:
+    global _session
+    with _lock:
+        session, _session = _session, None
+    if session is None:
+        raise RuntimeError("no profiling session is running")
+    return session.stop(limit)
+
+
+@contextmanager
+def profile_current_thread():
+    """Profile the calling handler thread if a cProfile session is active."""
+    session = _session
+    if session is None or session.mode != "cprofile" or PROCESS_WIDE_PROFILER:
+        yield
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # another profiler is active; the request still has to be served
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+        session.add_profile(profile)
+
+
+def tracemalloc_snapshot(top: int = 25, group_by: str = "lineno") -> str:
+    """
+    Return the top allocation sites. The first call starts tracing, so
+    numbers only cover allocations made after it.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(10)
+        return "tracemalloc started; request again for a snapshot\n"
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"traced: {current / 2**20:.1f} MiB, peak: {peak / 2**20:.1f} MiB"]
+    for stat in snapshot.statistics(group_by)[:top]:
+        lines.append(str(stat))
+    return "\n".join(lines) + "\n"
+
+
+def tracemalloc_stop() -> str:
+    tracemalloc.stop()
+    return "tracemalloc stopped\n"
+
+
+async def dump_asyncio_tasks(limit: int = 20) -> str:
+    """List the in-flight tasks of the running loop with their stacks."""
+    out = io.StringIO()
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    out.write(f"{len(tasks)} tasks\n")
+    for t in tasks:
+        out.write(f"\n{t!r}\n")
+        t.print_stack(limit=limit, file=out)
+    return out.getvalue()
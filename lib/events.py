@@ -0,0 +1,207 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter, deque
+from logging.handlers import RotatingFileHandler
+
+# Plugin-scoped structured event log. Events are kept as (name, fields) and
+# only rendered to text when read, so a gated or sampled-out event costs a
+# level comparison. Nothing here touches calibre's root logger: warnings and
+# errors are forwarded to the plugin's own logger, everything else stays in
+# the ring buffer (and the optional rotating file).
+#
+#   MANGADEX_LOG_LEVEL=debug          record debug events
+#   MANGADEX_LOG_FILE=/path/log.jsonl also append events to a rotating file
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+
+_logger = logging.getLogger("calibre_plugins.store_mangadex")
+
+
+def level_name(level: int) -> str:
+    return logging.getLevelName(level).lower()
+
+
+def parse_level(name: str) -> int:
+    try:
+        return LEVELS[name.lower()]
+    except KeyError:
+        raise ValueError(f"unknown level: {name}") from None
+
+
+def _plain(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class Event:
+    __slots__ = ("seq", "time", "level", "source", "name", "fields")
+
+    def __init__(self, seq: int, ts: float, level: int, source: str, name: str, fields: dict):
+        self.seq = seq
+        self.time = ts
+        self.level = level
+        self.source = source
+        self.name = name
+        self.fields = fields
+
+    def message(self) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in self.fields.items())
+        return f"{self.name} {fields}" if fields else self.name
+
+    def to_text(self) -> str:
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.time))
+        return f"{ts} {level_name(self.level).upper():<7} {self.source}: {self.message()}"
+
+    def to_dict(self) -> dict:
+        return {
+            "seq": self.seq,
+            "time": round(self.time, 3),
+            "level": level_name(self.level),
+            "source": self.source,
+            "name": self.name,
+            "fields": self.fields,
+        }
+
+
+class EventLog:
+    def __init__(self, capacity: int = 5000, level: int = INFO):
+        self.events: deque[Event] = deque(maxlen=capacity)
+        self.level = level
+        # event name -> fraction of events kept, for high-volume per-page events
+        self.sample_rates: dict[str, float] = {
+            "upstream_request": 0.05,
+            "page_written": 0.05,
+        }
+        self.sampled_out: Counter = Counter()
+        self._seq = itertools.count(1)
+        self._file: RotatingFileHandler | None = None
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def emit(self, level: int, source: str, name: str, fields: dict):
+        if level < self.level:
+            return
+        rate = self.sample_rates.get(name)
+        if rate is not None and rate < 1.0 and random.random() >= rate:
+            self.sampled_out[name] += 1
+            return
+        # plain values only: an exception kept in the ring buffer would keep
+        # its traceback and every frame it references (page bytes) alive
+        fields = {k: _plain(v) for k, v in fields.items()}
+        event = Event(next(self._seq), time.time(), level, source, name, fields)
+        self.events.append(event)
+        if level >= WARNING:
+            _logger.log(level, event.message())
+        handler = self._file
+        if handler is not None:
+            record = logging.LogRecord(
+                source, level, "", 0, json.dumps(event.to_dict(), ensure_ascii=False),
+                None, None)
+            handler.handle(record)
+
+    def query(self, level: int = DEBUG, name: str | None = None,
+              source: str | None = None, since: int = 0, limit: int = 200) -> list[Event]:
+        """Newest `limit` matching events with a sequence number above `since`."""
+        matched = [
+            e for e in list(self.events)
+            if e.seq > since and e.level >= level
+            and (name is None or e.name == name)
+            and (source is None or e.source.endswith(source))
+        ]
+        return matched[-limit:] if limit > 0 else matched
+
+    def configure(self, level: int | None = None,
+                  sample_rates: dict[str, float] | None = None):
+        if level is not None:
+            self.level = level
+        if sample_rates:
+            for name, rate in sample_rates.items():
+                if not 0.0 <= rate <= 1.0:
+                    raise ValueError(f"sample rate for {name} must be within [0, 1]")
+                self.sample_rates[name] = rate
+
+    def open_file(self, path: str, max_bytes: int = 5 * 2**20, backups: int = 3):
+        """Also append events as JSON lines to `path`, rotated at `max_bytes`."""
+        handler = RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        old, self._file = self._file, handler
+        if old is not None:
+            old.close()
+
+    def close_file(self):
+        old, self._file = self._file, None
+        if old is not None:
+            old.close()
+
+    def config(self) -> dict:
+        return {
+            "level": level_name(self.level),
+            "capacity": self.events.maxlen,
+            "buffered": len(self.events),
+            "sample_rates": dict(self.sample_rates),
+            "sampled_out": dict(self.sampled_out),
+            "file": self._file.baseFilename if self._file else None,
+        }
+
+
+event_log = EventLog(level=LEVELS.get(os.environ.get("MANGADEX_LOG_LEVEL", "").lower(), INFO))
+if os.environ.get("MANGADEX_LOG_FILE"):
+    event_log.open_file(os.environ["MANGADEX_LOG_FILE"])
+
+
+class EventLogger:
+    """Per-module front end: `log.info("name", key=value, ...)`."""
+
+    __slots__ = ("source",)
+
+    def __init__(self, source: str):
+        self.source = source.rsplit(".", 1)[-1]
+
+    def enabled(self, level: int) -> bool:
+        return event_log.enabled(level)
+
+    def debug(self, name: str, **fields):
+        if DEBUG >= event_log.level:
+            event_log.emit(DEBUG, self.source, name, fields)
+
+    def info(self, name: str, **fields):
+        if INFO >= event_log.level:
+            event_log.emit(INFO, self.source, name, fields)
+
+    def warning(self, name: str, **fields):
+        event_log.emit(WARNING, self.source, name, fields)
+
+    def error(self, name: str, **fields):
+        event_log.emit(ERROR, self.source, name, fields)
+
+
+def get_logger(name: str) -> EventLogger:
+    return EventLogger(name)
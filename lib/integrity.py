@@ -0,0 +1,78 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import hashlib
+import re
+from urllib.parse import unquote, urlparse
+
+# Cheap checks that a downloaded page is the complete file, run before it is
+# archived or cached: the body length against Content-Length (in fetch_bytes),
+# the SHA-256 MangaDex puts in full-quality page file names, and the image
+# format's start and end markers, which catch truncated bodies without
+# decoding anything.
+
+_SHA256_NAME = re.compile(r'-([0-9a-f]{64})\.\w+$')
+
+
+class IntegrityError(RuntimeError):
+    """A response that arrived but is not the complete, expected file."""
+
+    def __init__(self, reason: str, message: str, digest: str | None = None):
+        super().__init__(message)
+        # length, sha256, header or decode; used as a metric label
+        self.reason = reason
+        self.digest = digest
+
+
+def expected_sha256(url: str) -> str | None:
+    """SHA-256 from a /data/ page file name (`{n}-{sha256}.{ext}`), if any."""
+    path = unquote(urlparse(url).path)
+    # data-saver files are re-encoded; only full-quality names are checked
+    if '/data/' not in path:
+        return None
+    m = _SHA256_NAME.search(path)
+    return m.group(1) if m else None
+
+
+def image_format(data: bytes) -> str | None:
+    """Format name if `data` starts and ends like a complete image."""
+    tail = data[-64:]
+    if data[:3] == b'\xff\xd8\xff':
+        return "jpeg" if b'\xff\xd9' in tail else None
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return "png" if b'IEND\xaeB`\x82' in tail else None
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        # the trailer byte is last, at most followed by padding
+        return "gif" if data.rstrip(b'\0').endswith(b'\x3b') else None
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        size = int.from_bytes(data[4:8], 'little')
+        return "webp" if size + 8 <= len(data) else None
+    return None
+
+
+def verify_page(url: str, data: bytes):
+    """Raise IntegrityError unless `data` looks like the complete page at `url`."""
+    if image_format(data) is None:
+        raise IntegrityError(
+            "header", f"{url}: not a complete image ({len(data)} bytes)")
+    expected = expected_sha256(url)
+    if expected is not None:
+        digest = hashlib.sha256(data).hexdigest()
+        if digest != expected:
+            raise IntegrityError(
+                "sha256", f"{url}: SHA-256 {digest[:12]}… does not match the file name",
+                digest=digest)
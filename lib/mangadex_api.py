@@ -17,59 +17,101 @@
 
 import os
 import asyncio
+import time
 import urllib
 from .utils import download_json, download_bytes, resize_jpeg_bytes
-from ..model.mangadex import MangaInfo, VolumeInfo, Tag
-from calibre.utils.config import config_dir
-from calibre.utils.rapydscript import atomic_write
+from .metrics import CACHE_REQUESTS
+from .cache import THUMBNAIL_CACHE, get_cache, run_io
+from .search_index import index_manga
+from ..model.mangadex import MangaInfo, VolumeInfo, VolumeList, Tag
 
 PLUGIN_ID = 'MangaDex'
-THUMBNAIL_CACHE_DIR = os.path.join(
-    config_dir, 'plugins', PLUGIN_ID, 'thumbnail_cache')
-os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+# Overridable so a local stand-in of the MangaDex API can be used instead
+MANGADEX_API_URL = os.environ.get(
+    'MANGADEX_API_URL', 'https://api.mangadex.org')
+MANGADEX_COVERS_URL = os.environ.get(
+    'MANGADEX_COVERS_URL', 'https://mangadex.org/covers')
+
+
+# Parsed manga/aggregate responses are reused for a while, so opening the
+# detail page and then building a volume does not parse the same series twice.
+metadata_cache_ttl = 600
+_metadata_cache: dict = {}
+
+
+def _metadata_cache_get(key):
+    entry = _metadata_cache.get(key)
+    if entry is not None and time.monotonic() - entry[0] < metadata_cache_ttl:
+        CACHE_REQUESTS.inc(cache="metadata", result="hit")
+        return entry[1]
+    CACHE_REQUESTS.inc(cache="metadata", result="miss")
+    return None
+
+
+def _metadata_cache_put(key, value):
+    now = time.monotonic()
+    for k in [k for k, (t, _) in _metadata_cache.items() if now - t >= metadata_cache_ttl]:
+        del _metadata_cache[k]
+    _metadata_cache[key] = (now, value)
+
+
+def invalidate_manga_metadata(manga_id: str):
+    """Drop cached manga/aggregate entries, e.g. after new chapters were seen."""
+    for k in [k for k in _metadata_cache if k[1] == manga_id]:
+        del _metadata_cache[k]
 
 
 async def _get_mangadex(path: str):
-    return await download_json(f"https://api.mangadex.org{path}")
+    return await download_json(f"{MANGADEX_API_URL}{path}")
 
 
 async def get_manga_cover_96_cached(manga_id: str, cover_id: str) -> bytes:
-    global THUMBNAIL_CACHE_DIR
     file_name = f"{manga_id}.{cover_id}.96.jpg"
-    cache_path = os.path.join(
-        THUMBNAIL_CACHE_DIR, file_name)
-    try:
-        with open(cache_path, "rb") as f:
-            return f.read()
-    except:
-        data256 = await get_manga_cover_256(manga_id, cover_id)
-        data96 = resize_jpeg_bytes(data256)
-        atomic_write(THUMBNAIL_CACHE_DIR, file_name, data96)
+    cache = get_cache()
+    data96 = await run_io(cache.get, THUMBNAIL_CACHE, file_name)
+    if data96 is not None:
+        CACHE_REQUESTS.inc(cache="thumbnail", result="hit")
+        return data96
+    CACHE_REQUESTS.inc(cache="thumbnail", result="miss")
+    data256 = await get_manga_cover_256(manga_id, cover_id)
+    data96 = resize_jpeg_bytes(data256)
+    await run_io(cache.put, THUMBNAIL_CACHE, file_name, data96)
     return data96
 
 
 async def get_manga_cover_256(manga_id: str, cover_id: str) -> bytes:
     fn = f"{manga_id}/{cover_id}"
     data256 = await download_bytes(
-        f"https://mangadex.org/covers/{fn}.256.jpg")
+        f"{MANGADEX_COVERS_URL}/{fn}.256.jpg")
     return data256
 
 
 async def get_manga_info(manga_id: str) -> MangaInfo:
+    cached = _metadata_cache_get(("manga", manga_id))
+    if cached is not None:
+        return cached
     mng = await _get_mangadex(
         f"/manga/{manga_id}?includes[]=artist&includes[]=author&includes[]=cover_art")
-    return MangaInfo(mng['data'])
+    ret = MangaInfo(mng['data'])
+    _metadata_cache_put(("manga", manga_id), ret)
+    index_manga([ret])
+    return ret
 
 
-async def get_volumes_and_chapters(manga_id: str, language: str) -> list[VolumeInfo]:
+async def get_volumes_and_chapters(manga_id: str, language: str) -> VolumeList:
+    """Return the volumes of a manga in `language`; shared, do not mutate."""
+    cached = _metadata_cache_get(("aggregate", manga_id, language))
+    if cached is not None:
+        return cached
     url = f"/manga/{manga_id}/aggregate?translatedLanguage[]=" + language
     res = await _get_mangadex(url)
     volumes = res.get("volumes", {})
     # Fix for bug caused by MangaDex API returning empty array instead of empty object
     if isinstance(volumes, list):
-        return []
-    ret = [VolumeInfo.from_api(v) for v in volumes.values()]
-    ret.sort(key=lambda v: v.sort)
+        volumes = {}
+    ret = VolumeList(sorted(
+        (VolumeInfo.from_api(v) for v in volumes.values()), key=lambda v: v.sort))
+    _metadata_cache_put(("aggregate", manga_id, language), ret)
     return ret
 
 
@@ -95,14 +137,21 @@ async def get_tags() -> list[Tag]:
     return tags
 
 
-async def get_chapter_image_urls(chapter_id: str) -> list[str]:
+async def get_chapter_image_urls(chapter_id: str, data_saver: bool = False) -> list[str]:
+    """
+    Resolve the at-home node for a chapter and return its page URLs.
+    With `data_saver` the compressed variants under /data-saver/ are used.
+    """
     res = await _get_mangadex("/at-home/server/" +
                               chapter_id + "?forcePort443=false")
     base_url = res["baseUrl"]
     chapter_hash = res["chapter"]["hash"]
-    images = res["chapter"]["data"]
+    if data_saver:
+        quality, images = "data-saver", res["chapter"]["dataSaver"]
+    else:
+        quality, images = "data", res["chapter"]["data"]
     image_urls = list(
-        map(lambda img: f"{base_url}/data/{chapter_hash}/{img}", images)
+        map(lambda img: f"{base_url}/{quality}/{chapter_hash}/{img}", images)
     )
     return image_urls
 
@@ -131,4 +180,78 @@ async def search_manga(
             *[f"contentRating[]={t}" for t in content_ratings],
         ])
     )
-    return [MangaInfo(m) for m in res["data"]]
+    ret = [MangaInfo(m) for m in res["data"]]
+    index_manga(ret)
+    return ret
+
+
+ALL_CONTENT_RATINGS = ["safe", "suggestive", "erotica", "pornographic"]
+
+
+async def get_latest_uploaded_chapters(manga_ids: list[str]) -> dict[str, str | None]:
+    """
+    Map each manga id to its `latestUploadedChapter`, 100 series per request,
+    so unchanged series can be skipped without querying their feed.
+    """
+    ret = {}
+    for i in range(0, len(manga_ids), 100):
+        batch = manga_ids[i:i + 100]
+        res = await _get_mangadex(
+            "/manga?" + "&".join([
+                f"limit={len(batch)}",
+                *[f"ids[]={m}" for m in batch],
+                *[f"contentRating[]={r}" for r in ALL_CONTENT_RATINGS],
+            ]))
+        for m in res["data"]:
+            ret[m["id"]] = m["attributes"].get("latestUploadedChapter")
+    return ret
+
+
+async def get_chapter_feed(
+        manga_id: str, languages: list[str], updated_since: str | None = None,
+        page_size: int = 500) -> list[dict]:
+    """
+    Return the readable chapters of a manga in `languages`, optionally only
+    those updated at or after `updated_since` (MangaDex `YYYY-MM-DDTHH:MM:SS`).
+    Each item has id, volume, chapter, language, pages and updatedAt.
+    """
+    ret = []
+    offset = 0
+    while True:
+        params = [
+            f"limit={page_size}",
+            f"offset={offset}",
+            "order[updatedAt]=asc",
+            "includeExternalUrl=0",
+            "includeFuturePublishAt=0",
+            *[f"translatedLanguage[]={l}" for l in languages],
+            *[f"contentRating[]={r}" for r in ALL_CONTENT_RATINGS],
+        ]
+        if updated_since:
+            params.append(f"updatedAtSince={updated_since}")
+        res = await _get_mangadex(f"/manga/{manga_id}/feed?" + "&".join(params))
+        for ch in res["data"]:
+            attrs = ch["attributes"]
+            ret.append({
+                "id": ch["id"],
+                # same naming as the aggregate endpoint
+                "volume": attrs.get("volume") or "none",
+                "chapter": attrs.get("chapter") or "none",
+                "language": attrs["translatedLanguage"],
+                "pages": attrs.get("pages") or 0,
+                "updatedAt": attrs["updatedAt"],
+            })
+        offset += len(res["data"])
+        if not res["data"] or offset >= res.get("total", 0):
+            return ret
+
+
+async def get_chapter_page_counts(manga_id: str, language: str) -> dict[str, int]:
+    """Map chapter id to its page count, from the chapter feed (the aggregate has none)."""
+    cached = _metadata_cache_get(("pages", manga_id, language))
+    if cached is not None:
+        return cached
+    feed = await get_chapter_feed(manga_id, [language])
+    ret = {ch["id"]: ch["pages"] for ch in feed if ch["pages"]}
+    _metadata_cache_put(("pages", manga_id, language), ret)
+    return ret
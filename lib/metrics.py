@@ -0,0 +1,186 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+import bisect
+import threading
+import time
+
+# Minimal Prometheus-style metrics. Metrics are updated from the event loop
+# thread and the HTTP handler threads, so every update takes the lock.
+_lock = threading.Lock()
+_registry: list["_Metric"] = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(k, "") for k in self.labelnames)
+
+    def remove(self, **labels):
+        with _lock:
+            self.values.pop(self._key(labels), None)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.type}"]
+        for key, value in self.values.items():
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # per-bucket counts (last one is +Inf), sum, count
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.type}"]
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(
+                f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(
+                f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render_metrics() -> str:
+    """Return all metrics in the Prometheus text exposition format."""
+    with _lock:
+        lines = [line for m in _registry for line in m.render()]
+    return "\n".join(lines) + "\n"
+
+
+class timed:
+    """Context manager observing the elapsed seconds into a histogram."""
+
+    def __init__(self, histogram: Histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "mangadex_http_request_seconds",
+    "Latency of requests served by the local plugin server.", ("route", "code"))
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "mangadex_upstream_request_seconds",
+    "Latency of requests to MangaDex and at-home nodes.", ("host",))
+UPSTREAM_RESPONSES = Counter(
+    "mangadex_upstream_responses_total",
+    "Upstream responses by host and HTTP status (0 = network error).", ("host", "status"))
+UPSTREAM_BYTES = Counter(
+    "mangadex_upstream_bytes_total",
+    "Bytes downloaded from upstream hosts.", ("host",))
+SEMAPHORE_WAIT_SECONDS = Histogram(
+    "mangadex_semaphore_wait_seconds",
+    "Time spent waiting for a concurrency slot.", ("semaphore",))
+PAGES_DOWNLOADED = Counter(
+    "mangadex_pages_total",
+    "Pages written into CBZ archives.")
+TASK_PAGES_PER_SECOND = Gauge(
+    "mangadex_task_pages_per_second",
+    "Page throughput of the volume builds currently running.", ("task_id",))
+CACHE_REQUESTS = Counter(
+    "mangadex_cache_requests_total",
+    "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+PAGE_INTEGRITY_FAILURES = Counter(
+    "mangadex_page_integrity_failures_total",
+    "Downloaded pages rejected before archiving, by check.", ("reason",))
+PREFETCH_BYTES = Counter(
+    "mangadex_prefetch_bytes_total",
+    "Speculatively prefetched page bytes by result (used/wasted).", ("result",))
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "mangadex_event_loop_lag_seconds",
+    "How late the event loop wakes up compared to its schedule.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Run forever on the event loop, sampling its scheduling lag."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
@@ -0,0 +1,179 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from .events import get_logger
+from .metrics import CACHE_REQUESTS
+from ..model.mangadex import MangaInfo
+from calibre.utils.config import config_dir
+
+log = get_logger(__name__)
+
+# Local full-text index of every MangaInfo seen in search results and detail
+# pages (titles, alt titles, authors, tags), so known series can be found
+# without a round trip to MangaDex and searches still work when it is down.
+
+PLUGIN_ID = 'MangaDex'
+INDEX_DIR = os.path.join(config_dir, 'plugins', PLUGIN_ID)
+INDEX_FILE_NAME = 'search_index.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS manga (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    authors TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    cover_id TEXT NOT NULL,
+    content_rating TEXT,
+    seen_at REAL NOT NULL
+);
+-- rowid is the manga table's rowid, so a row is replaced without a scan
+CREATE VIRTUAL TABLE IF NOT EXISTS manga_fts USING fts5(
+    title, alt_titles, authors, tags,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+# bumped when _SCHEMA changes; an index of another version is rebuilt empty
+_SCHEMA_VERSION = 1
+
+
+class IndexedManga:
+    """The subset of MangaInfo a search result needs, read from the index."""
+
+    __slots__ = ('id', 'title', 'authors', 'tags', 'cover_id', 'content_rating')
+
+    def __init__(self, row):
+        self.id, self.title, authors, tags, self.cover_id, self.content_rating = row
+        self.authors = json.loads(authors)
+        self.tags = json.loads(tags)
+
+
+class SearchIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+            self._db.executescript(
+                "DROP TABLE IF EXISTS manga_fts; DROP TABLE IF EXISTS manga; "
+                f"PRAGMA user_version = {_SCHEMA_VERSION};")
+        self._db.executescript(_SCHEMA)
+
+    def add(self, infos: list[MangaInfo]):
+        now = time.time()
+        rows = [(
+            m.id, m.title, json.dumps(m.authors, ensure_ascii=False),
+            json.dumps(m.tags, ensure_ascii=False), m.cover_id, m.content_rating,
+            " ".join(m.alt_titles),
+        ) for m in infos if m.id]
+        # one row per manga, or its FTS rowid would be inserted twice
+        rows = list({r[0]: r for r in rows}.values())
+        with self._lock, self._db:
+            # an upsert keeps the rowid the FTS row is keyed by
+            self._db.executemany(
+                "INSERT INTO manga VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET title = excluded.title, "
+                "authors = excluded.authors, tags = excluded.tags, "
+                "cover_id = excluded.cover_id, content_rating = excluded.content_rating, "
+                "seen_at = excluded.seen_at",
+                [r[:6] + (now,) for r in rows])
+            rowids = [self._db.execute(
+                "SELECT rowid FROM manga WHERE id = ?", (r[0],)).fetchone()[0] for r in rows]
+            self._db.executemany(
+                "DELETE FROM manga_fts WHERE rowid = ?", [(i,) for i in rowids])
+            self._db.executemany(
+                "INSERT INTO manga_fts (rowid, title, alt_titles, authors, tags) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(i, r[1], r[6], " ".join(json.loads(r[2])), " ".join(json.loads(r[3])))
+                 for i, r in zip(rowids, rows)])
+
+    def search(self, query: str, limit: int) -> list[IndexedManga]:
+        """Best matches first; every word must match as a prefix somewhere."""
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        match = " ".join(f'"{w}"*' for w in words)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT m.id, m.title, m.authors, m.tags, m.cover_id, m.content_rating "
+                "FROM manga_fts f JOIN manga m ON m.rowid = f.rowid "
+                "WHERE manga_fts MATCH ? "
+                "ORDER BY bm25(manga_fts, 10.0, 5.0, 2.0, 1.0) LIMIT ?",
+                (match, limit)).fetchall()
+        return [IndexedManga(r) for r in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM manga").fetchone()[0]
+
+
+_index: SearchIndex | None = None
+_index_failed = False
+
+
+def get_index() -> SearchIndex | None:
+    """Open the index on first use; None if SQLite/FTS5 is not usable here."""
+    global _index, _index_failed
+    if _index is None and not _index_failed:
+        try:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            _index = SearchIndex(os.path.join(INDEX_DIR, INDEX_FILE_NAME))
+        except (sqlite3.Error, OSError) as e:
+            _index_failed = True
+            log.warning("search_index_unavailable", error=e)
+    return _index
+
+
+_pending_writes: set[asyncio.Task] = set()
+
+
+async def _write(index: SearchIndex, infos: list[MangaInfo]):
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, index.add, infos)
+    except sqlite3.Error as e:
+        log.warning("search_index_write_failed", error=e)
+
+
+def index_manga(infos: list[MangaInfo]):
+    """Add or refresh `infos` in the index in the background; never raises."""
+    index = get_index()
+    if index is None or not infos:
+        return
+    task = asyncio.get_running_loop().create_task(_write(index, infos))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+
+def search_local(query: str, limit: int) -> list[IndexedManga]:
+    index = get_index()
+    if index is None:
+        return []
+    try:
+        found = index.search(query, limit)
+    except sqlite3.Error as e:
+        log.warning("search_index_query_failed", error=e)
+        return []
+    CACHE_REQUESTS.inc(cache="search_index", result="hit" if found else "miss")
+    return found
@@ -0,0 +1,131 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# The trace of the volume build running in the current asyncio context.
+# Tasks created by the build inherit it, so helpers can record spans
+# without threading the trace through every signature.
+current_trace: ContextVar["TaskTrace | None"] = ContextVar(
+    "current_trace", default=None)
+# Timeline lane of the page handled by the current task (0 = whole volume).
+current_lane: ContextVar[int] = ContextVar("current_lane", default=0)
+
+
+class Span:
+    __slots__ = ('name', 'start', 'end', 'lane', 'attrs')
+
+    def __init__(self, name: str, start: float, lane: int, attrs: dict):
+        self.name = name
+        self.start = start
+        self.end = None
+        # 0 for whole-volume phases, page index + 1 for per-page work
+        self.lane = lane
+        self.attrs = attrs
+
+
+class TaskTrace:
+    """Lightweight span recorder for one volume build."""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.start = time.monotonic()
+        self.spans: list[Span] = []
+
+    @contextmanager
+    def span(self, name: str, lane: int = 0, **attrs):
+        s = Span(name, time.monotonic(), lane, attrs)
+        self.spans.append(s)
+        try:
+            yield s
+        except BaseException as e:
+            s.attrs["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            s.end = time.monotonic()
+
+    def event(self, name: str, lane: int = 0, **attrs):
+        s = Span(name, time.monotonic(), lane, attrs)
+        s.end = s.start
+        self.spans.append(s)
+
+    def _ms(self, t: float) -> float:
+        return round((t - self.start) * 1000, 3)
+
+    def summary(self) -> dict:
+        """Per-phase span count and total milliseconds."""
+        ret = {}
+        for s in self.spans:
+            phase = ret.setdefault(s.name, {"count": 0, "total_ms": 0.0})
+            phase["count"] += 1
+            if s.end is not None:
+                phase["total_ms"] = round(
+                    phase["total_ms"] + (s.end - s.start) * 1000, 3)
+        return ret
+
+    def to_timeline(self) -> list[dict]:
+        return [
+            {
+                "name": s.name,
+                "lane": s.lane,
+                "start_ms": self._ms(s.start),
+                "end_ms": None if s.end is None else self._ms(s.end),
+                **s.attrs
+            }
+            for s in self.spans
+        ]
+
+    def to_chrome_trace(self) -> dict:
+        """Chrome trace event JSON, viewable in chrome://tracing or Perfetto."""
+        events = [{
+            "name": "thread_name", "ph": "M", "pid": 1, "tid": 0,
+            "args": {"name": "volume"}
+        }]
+        now = time.monotonic()
+        for s in self.spans:
+            end = s.end if s.end is not None else now
+            events.append({
+                "name": s.name,
+                "cat": "mangadex",
+                "ph": "X" if end > s.start else "i",
+                "ts": round((s.start - self.start) * 1e6),
+                "dur": round((end - s.start) * 1e6),
+                "pid": 1,
+                "tid": s.lane,
+                "args": s.attrs
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"task_id": self.task_id}}
+
+
+@contextmanager
+def trace_span(name: str, **attrs):
+    """Record a span on the current task trace; a no-op outside a build."""
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, current_lane.get(), **attrs) as s:
+        yield s
+
+
+def trace_event(name: str, **attrs):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.event(name, current_lane.get(), **attrs)
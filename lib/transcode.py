@@ -0,0 +1,137 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TranscodeProfile:
+    """
+    Describes how pages are rewritten before they go into the CBZ.
+    A profile with no options keeps the original page (only rotated).
+    """
+
+    def __init__(self, name: str, max_size: tuple[int, int] | None = None,
+                 grayscale: bool = False, format: str | None = None,
+                 quality: int = 85, split_long_strips: bool = False):
+        self.name = name
+        # (width, height) box the page is shrunk to fit in
+        self.max_size = max_size
+        self.grayscale = grayscale
+        # "JPEG", "WEBP" or None to keep the source format
+        self.format = format
+        self.quality = quality
+        # cut pages much taller than the device screen into screen-sized slices
+        self.split_long_strips = split_long_strips
+
+    def to_dict(self) -> dict:
+        return {
+            "type": "TranscodeProfile",
+            "name": self.name,
+            "max_size": self.max_size,
+            "grayscale": self.grayscale,
+            "format": self.format,
+            "quality": self.quality,
+            "split_long_strips": self.split_long_strips
+        }
+
+
+TRANSCODE_PROFILES: dict[str, TranscodeProfile] = {
+    p.name: p for p in [
+        TranscodeProfile("original"),
+        TranscodeProfile("eink6", max_size=(1072, 1448), grayscale=True,
+                         format="JPEG", quality=80, split_long_strips=True),
+        TranscodeProfile("eink6-webp", max_size=(1072, 1448), grayscale=True,
+                         format="WEBP", quality=75, split_long_strips=True),
+        TranscodeProfile("tablet", max_size=(1600, 2560),
+                         format="JPEG", quality=85, split_long_strips=True),
+    ]
+}
+DEFAULT_PROFILE = "original"
+
+_extensions = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png", "GIF": "gif"}
+_executor: ThreadPoolExecutor | None = None
+# a page is a "long strip" when it is this many times taller than the screen
+_long_strip_ratio = 1.5
+
+
+def get_transcode_executor() -> ThreadPoolExecutor:
+    """
+    Threads for transcode_page, one per CPU. Kept apart from the loop's
+    default executor, where page downloads block in urllib, so CPU-heavy
+    profiles do not hold up downloads (Pillow releases the GIL while it
+    resizes and encodes).
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=os.cpu_count() or 1, thread_name_prefix="mangadex-transcode")
+    return _executor
+
+
+def _split_long_strip(img: "Image.Image", max_size: tuple[int, int]) -> list["Image.Image"]:
+    screen_ratio = max_size[1] / max_size[0]
+    if img.height < img.width * screen_ratio * _long_strip_ratio:
+        return [img]
+    slice_height = int(img.width * screen_ratio)
+    return [
+        img.crop((0, top, img.width, min(top + slice_height, img.height)))
+        for top in range(0, img.height, slice_height)
+    ]
+
+
+def _is_passthrough(profile: TranscodeProfile) -> bool:
+    return not (profile.max_size or profile.grayscale or profile.format)
+
+
+def transcode_page(image_data: bytes, profile: TranscodeProfile) -> list[tuple[str, bytes]]:
+    """
+    Rotate, split, resize and re-encode one page according to `profile`.
+    CPU bound; meant to run in an executor thread.
+
+    :returns: list of (file extension, encoded bytes), one per output page
+    """
+    # Pillow is only needed once pages are built, keep it out of plugin startup
+    from PIL import Image
+    with Image.open(io.BytesIO(image_data)) as img:
+        img_format = profile.format or img.format or "PNG"
+        if img.width <= img.height and _is_passthrough(profile):
+            # nothing to change, keep the original bytes instead of re-encoding
+            return [(_extensions.get(img_format, img_format.lower()), image_data)]
+        img.load()
+        if img.width > img.height:
+            img = img.rotate(90, expand=True)
+        slices = [img]
+        if profile.split_long_strips and profile.max_size:
+            slices = _split_long_strip(img, profile.max_size)
+        ret = []
+        for page in slices:
+            if profile.max_size:
+                page.thumbnail(profile.max_size, Image.Resampling.LANCZOS)
+            if profile.grayscale:
+                page = page.convert("L")
+            elif img_format == "JPEG" and page.mode not in ("RGB", "L"):
+                page = page.convert("RGB")
+            with io.BytesIO() as out:
+                if profile.format:
+                    page.save(out, img_format, quality=profile.quality)
+                else:
+                    page.save(out, img_format)
+                ret.append((_extensions.get(img_format, img_format.lower()),
+                            out.getvalue()))
+        return ret
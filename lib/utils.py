@@ -15,22 +15,26 @@
  along with this program. If not, see <https://www.gnu.org/licenses/>.
  """
 
+import http.client
 import urllib.error
 import urllib.request
 import json
 import ssl
 import asyncio
-import logging
 import ipaddress
-from typing import Any, Dict, Tuple
+import random
+import time
+from collections import deque
+from urllib.parse import urlparse
+from typing import Any, Awaitable, Callable, Dict, Tuple
 from functools import partial
 import io
-from PIL import Image
+from .metrics import (
+    SEMAPHORE_WAIT_SECONDS, UPSTREAM_BYTES, UPSTREAM_REQUEST_SECONDS, UPSTREAM_RESPONSES)
+from .events import get_logger
+from .integrity import IntegrityError
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger(__name__)
+log = get_logger(__name__)
 
 parallel_request_limit = 6
 req_semaphore = None
@@ -42,7 +46,7 @@ def get_req_semaphore() -> asyncio.Semaphore:
     if req_semaphore != None:
         return req_semaphore
     else:
-        logger.info("new semaphore")
+        log.debug("semaphore_created", limit=parallel_request_limit)
         req_semaphore = asyncio.Semaphore(parallel_request_limit)
         return req_semaphore
 
@@ -103,20 +107,48 @@ async def fetch(
         return e.code, dict(e.headers.items()), e.read()
 
 active = 0
+# Optional hook awaited before every upstream request, e.g. to take a token
+# from a rate limit shared with other worker processes.
+upstream_gate: Callable[[str], Awaitable[None]] | None = None
 
 
-async def download_bytes(url: str, **kw) -> Any:
-    """Fetch URL and return `json.loads()` of its body."""
+async def fetch_bytes(url: str, **kw) -> bytes:
+    """Fetch URL and return its body; the caller must hold the request semaphore."""
     global active
-    async with get_req_semaphore():
-        active += 1
-        logger.info(f"requesting: {url} active: {active}")
-        status, _, body = await fetch(url, headers=mock_headers, **kw)
+    if upstream_gate is not None:
+        await upstream_gate(url)
+    active += 1
+    host = urlparse(url).netloc
+    status = 0
+    start = time.monotonic()
+    try:
+        status, headers, body = await fetch(url, headers=mock_headers, **kw)
+    except http.client.IncompleteRead as e:
+        raise IntegrityError(
+            "length", f"GET {url} → connection closed after {len(e.partial)} bytes") from e
+    finally:
         active -= 1
-        if status != 200:
-            raise RuntimeError(f"GET {url} → HTTP {status}")
-        logger.info(f"requested: {url} ok")
-        return body
+        elapsed = time.monotonic() - start
+        UPSTREAM_REQUEST_SECONDS.observe(elapsed, host=host)
+        UPSTREAM_RESPONSES.inc(host=host, status=status)
+        log.debug("upstream_request", url=url, status=status,
+                  ms=round(elapsed * 1000, 1), active=active)
+    UPSTREAM_BYTES.inc(len(body), host=host)
+    if status != 200:
+        raise RuntimeError(f"GET {url} → HTTP {status}")
+    length = headers.get("content-length", "")
+    if length.isdigit() and int(length) != len(body):
+        raise IntegrityError(
+            "length", f"GET {url} → {len(body)} of {length} bytes")
+    return body
+
+
+async def download_bytes(url: str, **kw) -> bytes:
+    """Fetch URL under the shared request semaphore and return its body."""
+    start = time.monotonic()
+    async with get_req_semaphore():
+        SEMAPHORE_WAIT_SECONDS.observe(time.monotonic() - start, semaphore="request")
+        return await fetch_bytes(url, **kw)
 
 
 async def download_json(url: str, **kw) -> Any:
@@ -124,6 +156,96 @@ async def download_json(url: str, **kw) -> Any:
     return json.loads(body)
 
 
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second, bursting up to `burst`."""
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LatencyTracker:
+    """
+    Rolling window of observed request latencies (in seconds).
+    Used to decide when a slow request deserves a hedged duplicate.
+    """
+
+    def __init__(self, window: int = 256, min_samples: int = 8):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        """Return the `p` quantile (0..1) or None while there is too little data."""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(p * len(ordered)))
+        return ordered[index]
+
+
+async def first_successful(tasks: list[asyncio.Task]) -> Any:
+    """
+    Return the result of the first task that finishes without raising,
+    cancelling the others. Re-raises the last error if every task fails.
+    """
+    pending = set(tasks)
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    return t.result()
+                error = t.exception()
+        raise error
+    finally:
+        for t in pending:
+            t.cancel()
+
+
+async def retry_with_backoff(
+        fn: Callable[[int], Awaitable[Any]],
+        attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0) -> Any:
+    """
+    Call `fn(attempt)` until it succeeds, sleeping a "full jitter"
+    exponential backoff between attempts. Re-raises the last error.
+    """
+    for attempt in range(attempts):
+        try:
+            return await fn(attempt)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            log.info("retry", attempt=attempt + 1, error=e, delay=round(delay, 2))
+            await asyncio.sleep(delay)
+
+
 def resize_jpeg_bytes(data: bytes, max_size=(96, 96), quality=85) -> bytes:
     """
     :param data: original JPEG as bytes
@@ -131,6 +253,7 @@ def resize_jpeg_bytes(data: bytes, max_size=(96, 96), quality=85) -> bytes:
     :param quality: JPEG quality for output (1-95)
     :returns: resized JPEG as bytes
     """
+    from PIL import Image
     with io.BytesIO(data) as inp:
         with Image.open(inp) as img:
             img = img.convert("RGB")
@@ -140,17 +263,6 @@ def resize_jpeg_bytes(data: bytes, max_size=(96, 96), quality=85) -> bytes:
                 return out.getvalue()
 
 
-def ensure_image_vertical(image_data: bytes) -> bytes:
-    rotated_io = io.BytesIO()
-    with Image.open(image_data) as img:
-        img_format = img.format if img.format else "PNG"
-        if img.width > img.height:
-            img = img.rotate(90, expand=True)
-        img.save(rotated_io, img_format)
-        rotated_io.seek(0)
-    return rotated_io
-
-
 def delete_files_older_than(folder_path: str, hours: float = 12.0) -> None:
     """
     Delete all files in `folder_path` older than `hours` hours.
@@ -172,9 +284,9 @@ def delete_files_older_than(folder_path: str, hours: float = 12.0) -> None:
             if mtime < cutoff:
                 try:
                     file.unlink()
-                    print(f"Deleted: {file.name}")
+                    log.info("cache_file_deleted", file=file.name)
                 except Exception as e:
-                    print(f"Could not delete {file.name}: {e}")
+                    log.warning("cache_file_delete_failed", file=file.name, error=e)
 
 
 def is_localhost(ip: str, port: int | None = None) -> bool:
@@ -18,7 +18,7 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import logging
+import threading
 import urllib.parse
 import json
 
@@ -27,28 +27,35 @@ from calibre.gui2.store import StorePlugin
 from calibre.gui2.store.search_result import SearchResult
 from calibre.gui2.store.web_store_dialog import WebStoreDialog
 
-from .server import LocalServer
+from .lib.events import get_logger
 
 USER_AGENT = "Mozilla/5.0 (Windows NT 6.1; Trident/7.0; rv:11.0) like Gecko"
-port = 0
+_server = None
+_server_lock = threading.Lock()
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger(__name__)
+log = get_logger(__name__)
 
 
-class MangaDexStorePlugin(StorePlugin):
-    def __init__(self, *args, **kwargs):
-        super(MangaDexStorePlugin, self).__init__(*args, **kwargs)
-        global port
-        self.port = 50051
-        self.server = LocalServer(self.port)
-        port = self.port
-        self.server.start()
-        logger.info(f"MangaDex :: started server on port {self.port}")
+def get_server_port() -> int:
+    """
+    Start the local server on first use and return its port.
+    The server (and everything it imports) is only loaded once the store is
+    actually opened or searched, so calibre startup does not pay for it.
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            from .server import LocalServer
+            server = LocalServer()
+            server.start()
+            _server = server
+            log.info("server_started", port=_server.port)
+        return _server.port
+
 
+class MangaDexStorePlugin(StorePlugin):
     def open(self, parent=None, detail_item=None, external=False):
+        port = get_server_port()
         url = f"http://localhost:{port}"
         d = WebStoreDialog(self.gui, url, parent, detail_item)
         d.setWindowTitle(self.name)
@@ -56,9 +63,10 @@ class MangaDexStorePlugin(StorePlugin):
 
     @staticmethod
     def search(query, max_results=10, timeout=60):
+        port = get_server_port()
         encoded_query = urllib.parse.quote(query)
         search_url = f"http://localhost:{port}/search?q={encoded_query}&max_results={max_results}"
-        logger.info(search_url)
+        log.debug("store_search", url=search_url)
         br = browser(user_agent=USER_AGENT)
         raw = br.open(search_url, timeout=timeout).read()
         res = json.loads(raw)
@@ -26,65 +26,109 @@ def is_number(s: str) -> bool:
         return False
 
 
+_UNSET = object()
+
+
 class MangaInfo:
     """
     Class to parse and store manga information from a raw API response dict.
+    Fields are parsed lazily on first access, so a search result that only
+    needs a title and a cover does not pay for tags and descriptions.
     """
 
+    __slots__ = ('id', '_attributes', '_relationships', '_title', '_authors',
+                 '_tags', '_cover_id', '_description', '_year')
+
     def __init__(self, manga_data: dict):
         # Basic identifiers
         self.id = manga_data.get('id')
-        attributes = manga_data.get('attributes', {})
-        relationships = manga_data.get('relationships', [])
-
-        # Title handling
-        title_lang = next(iter(attributes.get('title', {})), None)
-        primary_title = attributes.get('title', {}).get(title_lang, '')
-        # Find English alternative title if exists
-        alt_title = next(
-            (t.get('en') for t in attributes.get('altTitles', []) if 'en' in t),
-            primary_title
-        )
-        if primary_title != alt_title:
-            self.title = f"{primary_title} | {alt_title}"
-        else:
-            self.title = primary_title
+        self._attributes = manga_data.get('attributes', {})
+        self._relationships = manga_data.get('relationships', [])
+        self._title = self._authors = self._tags = _UNSET
+        self._cover_id = self._description = self._year = _UNSET
 
+    @property
+    def title(self) -> str:
+        if self._title is _UNSET:
+            titles = self._attributes.get('title', {})
+            title_lang = next(iter(titles), None)
+            primary_title = titles.get(title_lang, '')
+            # Find English alternative title if exists
+            alt_title = next(
+                (t.get('en') for t in self._attributes.get('altTitles', []) if 'en' in t),
+                primary_title
+            )
+            if primary_title != alt_title:
+                self._title = f"{primary_title} | {alt_title}"
+            else:
+                self._title = primary_title
+        return self._title
+
+    @property
+    def authors(self) -> list[str]:
         # Authors and artists
-        self.authors = list({
-            r['attributes']['name']
-            for r in relationships
-            if r.get('type') in ('author', 'artist') and 'attributes' in r
-        })
+        if self._authors is _UNSET:
+            self._authors = list({
+                r['attributes']['name']
+                for r in self._relationships
+                if r.get('type') in ('author', 'artist') and 'attributes' in r
+            })
+        return self._authors
 
+    @property
+    def tags(self) -> list[str]:
         # Tags (English names)
-        self.tags = ["Manga"] + [
-            tag['attributes']['name']['en']
-            for tag in attributes.get('tags', [])
-            if tag.get('attributes', {}).get('name', {}).get('en')
-        ]
+        if self._tags is _UNSET:
+            self._tags = ["Manga"] + [
+                tag['attributes']['name']['en']
+                for tag in self._attributes.get('tags', [])
+                if tag.get('attributes', {}).get('name', {}).get('en')
+            ]
+        return self._tags
 
+    @property
+    def cover_id(self) -> str:
         # Cover art filename
-        self.cover_id = next(
-            (r['attributes']['fileName']
-             for r in relationships if r.get('type') == 'cover_art'),
-            ''
-        )
-
-        # Description and year
-        self.description = attributes.get('description', {}).get('en', '')
-        year_value = attributes.get('year')
-        try:
-            self.year = int(year_value)
-        except (TypeError, ValueError):
-            self.year = None
+        if self._cover_id is _UNSET:
+            self._cover_id = next(
+                (r['attributes']['fileName']
+                 for r in self._relationships if r.get('type') == 'cover_art'),
+                ''
+            )
+        return self._cover_id
 
-        # Content rating
-        self.content_rating = attributes.get('contentRating', None)
+    @property
+    def description(self) -> str:
+        if self._description is _UNSET:
+            self._description = self._attributes.get(
+                'description', {}).get('en', '')
+        return self._description
 
+    @property
+    def year(self) -> int | None:
+        if self._year is _UNSET:
+            try:
+                self._year = int(self._attributes.get('year'))
+            except (TypeError, ValueError):
+                self._year = None
+        return self._year
+
+    @property
+    def content_rating(self) -> str | None:
+        return self._attributes.get('contentRating', None)
+
+    @property
+    def alt_titles(self) -> list[str]:
+        # every title and alternative title in any language, for search indexing
+        titles = list(self._attributes.get('title', {}).values())
+        for t in self._attributes.get('altTitles', []):
+            titles.extend(t.values())
+        return titles
+
+    @property
+    def translated_languages(self) -> list[str] | None:
         # Available languages
-        self.translated_languages = attributes.get(
-            'availableTranslatedLanguages', None)
+        return self._attributes.get('availableTranslatedLanguages', None)
 
     def to_dict(self) -> dict:
         """
@@ -144,6 +188,8 @@ class MangaInfo:
 
 
 class ChapterInfo:
+    __slots__ = ('name', 'chapter_id_variants', 'sort')
+
     def __init__(self, name: str, chapter_id_variants: list[str]):
         self.name = name
         # a chapter can have multiple ids if multiple translations for the same language were made
@@ -167,6 +213,8 @@ class ChapterInfo:
 
 
 class VolumeInfo:
+    __slots__ = ('name', 'chapters', 'sort', '_chapter_index', '_dict')
+
     def __init__(self, name: str, chapters: list[ChapterInfo]):
         self.name = name
         self.chapters = chapters
@@ -175,13 +223,27 @@ class VolumeInfo:
             self.sort = float(name)
         except (ValueError, TypeError):
             self.sort = 1e6
+        self._chapter_index = None
+        self._dict = None
+
+    def get_chapters(self, names) -> list[ChapterInfo]:
+        """Return the chapters named in `names`, in reading order."""
+        if self._chapter_index is None:
+            self._chapter_index = {
+                c.name: i for i, c in enumerate(self.chapters)}
+        positions = sorted({
+            self._chapter_index[n] for n in names if n in self._chapter_index})
+        return [self.chapters[i] for i in positions]
 
     def to_dict(self) -> dict:
-        return {
-            "type": "VolumeInfo",
-            "name": self.name,
-            "chapters": [c.to_dict() for c in self.chapters]
-        }
+        # volumes are shared through the aggregate cache; treat the result as read-only
+        if self._dict is None:
+            self._dict = {
+                "type": "VolumeInfo",
+                "name": self.name,
+                "chapters": [c.to_dict() for c in self.chapters]
+            }
+        return self._dict
 
     @classmethod
     def from_api(self, obj: dict) -> "VolumeInfo":
@@ -190,7 +252,24 @@ class VolumeInfo:
         return VolumeInfo(obj['volume'], chapters)
 
 
+class VolumeList(list):
+    """The volumes of a manga in one language, in reading order."""
+    __slots__ = ('_volume_index',)
+
+    def __init__(self, volumes=()):
+        super().__init__(volumes)
+        self._volume_index = None
+
+    def get_volume(self, name: str) -> VolumeInfo | None:
+        # the list is shared through the aggregate cache, so the index is built once
+        if self._volume_index is None:
+            self._volume_index = {v.name: v for v in self}
+        return self._volume_index.get(name)
+
+
 class Tag:
+    __slots__ = ('name', 'id')
+
     def __init__(self, name: str, id: str):
         self.name = name
         self.id = id
@@ -0,0 +1,293 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from ..lib.mangadex_api import (
+    PLUGIN_ID, get_manga_info, get_volumes_and_chapters, get_chapter_feed,
+    get_latest_uploaded_chapters, invalidate_manga_metadata)
+from ..lib.events import get_logger
+from ..lib.transcode import TRANSCODE_PROFILES, DEFAULT_PROFILE
+from . import scrape
+from .manga_info import file_prefix, get_volume_plan
+from calibre.utils.config import config_dir
+from calibre.utils.rapydscript import atomic_write
+
+log = get_logger(__name__)
+
+# Followed series and their sync cursors, persisted as JSON in the plugin
+# config dir. A sync asks MangaDex only for chapters updated since each
+# series' cursor and rebuilds just the volume parts that gained chapters.
+FOLLOWS_DIR = os.path.join(config_dir, 'plugins', PLUGIN_ID)
+FOLLOWS_FILE_NAME = 'follows.json'
+
+_follows: dict | None = None
+sync_state = {"status": "idle"}
+
+
+class Follow:
+    def __init__(self, manga_id: str, title: str, languages: list[str],
+                 data_saver: bool = False, profile: str = DEFAULT_PROFILE,
+                 cursor: str | None = None, latest_uploaded_chapter: str | None = None,
+                 known_chapters: dict[str, list[str]] | None = None):
+        self.manga_id = manga_id
+        self.title = title
+        self.languages = languages
+        self.data_saver = data_saver
+        self.profile = profile
+        # updatedAt of the newest chapter already handled, in API format
+        self.cursor = cursor
+        self.latest_uploaded_chapter = latest_uploaded_chapter
+        # language -> chapter names already built or present when followed
+        self.known_chapters = known_chapters or {}
+
+    @property
+    def prefix(self) -> str:
+        return file_prefix(self.title)
+
+    def to_dict(self) -> dict:
+        return {
+            "type": "follow",
+            "manga_id": self.manga_id,
+            "title": self.title,
+            "languages": self.languages,
+            "data_saver": self.data_saver,
+            "profile": self.profile,
+            "cursor": self.cursor,
+            "latest_uploaded_chapter": self.latest_uploaded_chapter,
+            "known_chapters": self.known_chapters,
+        }
+
+    @staticmethod
+    def from_dict(obj: dict) -> 'Follow':
+        return Follow(
+            obj["manga_id"], obj["title"], obj["languages"],
+            obj.get("data_saver", False), obj.get("profile", DEFAULT_PROFILE),
+            obj.get("cursor"), obj.get("latest_uploaded_chapter"),
+            obj.get("known_chapters"))
+
+
+def _load_follows() -> dict[str, Follow]:
+    global _follows
+    if _follows is None:
+        try:
+            with open(os.path.join(FOLLOWS_DIR, FOLLOWS_FILE_NAME), 'rb') as f:
+                data = json.loads(f.read())
+            _follows = {o["manga_id"]: Follow.from_dict(o) for o in data["follows"]}
+        except FileNotFoundError:
+            _follows = {}
+    return _follows
+
+
+def _save_follows():
+    data = {"follows": [f.to_dict() for f in _load_follows().values()]}
+    os.makedirs(FOLLOWS_DIR, exist_ok=True)
+    atomic_write(FOLLOWS_DIR, FOLLOWS_FILE_NAME,
+                 json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+def _now_cursor() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+def _since_param(cursor: str) -> str:
+    # updatedAtSince takes a timezone-less UTC timestamp
+    return cursor[:19]
+
+
+async def list_follows() -> list[dict]:
+    return [f.to_dict() for f in _load_follows().values()]
+
+
+async def add_follow(manga_id: str, languages: list[str], data_saver: bool = False,
+                     profile: str = DEFAULT_PROFILE) -> dict:
+    """
+    Follow a series from now on: chapters that exist today are recorded as
+    known, so the first sync only builds what is released afterwards.
+    """
+    if profile not in TRANSCODE_PROFILES:
+        raise ValueError(f"unknown transcode profile: {profile}")
+    if not languages:
+        raise ValueError("at least one language is required")
+    info = await get_manga_info(manga_id)
+    known = {}
+    for lang in languages:
+        volumes = await get_volumes_and_chapters(manga_id, lang)
+        known[lang] = [c.name for v in volumes for c in v.chapters]
+    follow = Follow(manga_id, info.title, languages, data_saver, profile,
+                    cursor=_now_cursor(), known_chapters=known)
+    _load_follows()[manga_id] = follow
+    _save_follows()
+    log.info("follow_added", manga_id=manga_id, languages=",".join(languages))
+    return follow.to_dict()
+
+
+async def remove_follow(manga_id: str) -> bool:
+    removed = _load_follows().pop(manga_id, None) is not None
+    if removed:
+        _save_follows()
+    return removed
+
+
+def _affected_parts(parts: list[dict], new_names: set[str]) -> list[tuple[int, list[str]]]:
+    """Return (part, chapter names) of the planned parts containing new chapters."""
+    return [(p["part"], p["chapters"]) for p in parts if new_names & set(p["chapters"])]
+
+
+async def _plan_new_chapters(
+        manga_id: str, language: str, volume_name: str,
+        names: set[str]) -> tuple[list[tuple[int, list[str]]], set[str]]:
+    """
+    Planned parts containing new chapters, and the new chapters no part
+    contains even after the aggregate was fetched again.
+    """
+    for attempt in range(2):
+        if attempt:
+            # the cached aggregate may lag behind the feed
+            invalidate_manga_metadata(manga_id)
+        plan = await get_volume_plan(manga_id, language)
+        affected = _affected_parts(plan.get(volume_name, []), names)
+        missing = names.difference(*(part_names for _, part_names in affected))
+        if not missing:
+            break
+    return affected, missing
+
+
+async def _wait_for_task(task_id: str, poll: float = 0.5) -> str:
+    while True:
+        status = scrape.tasks_status.get(task_id, ("unknown task", ""))[0]
+        if status not in ("scheduled", "running"):
+            return status
+        await asyncio.sleep(poll)
+
+
+async def _sync_follow(follow: Follow) -> dict:
+    feed = await get_chapter_feed(
+        follow.manga_id, follow.languages,
+        _since_param(follow.cursor) if follow.cursor else None)
+    known = {lang: set(names) for lang, names in follow.known_chapters.items()}
+    new = {}
+    for ch in feed:
+        if ch["chapter"] not in known.get(ch["language"], ()):
+            new.setdefault((ch["language"], ch["volume"]), set()).add(ch["chapter"])
+    ret = {"manga_id": follow.manga_id, "new_chapters": sum(len(n) for n in new.values()),
+           "builds": [], "complete": True}
+    if new:
+        # the aggregate may predate the new chapters
+        invalidate_manga_metadata(follow.manga_id)
+    builds = []
+    failed = False
+    for (lang, volume_name), names in sorted(new.items()):
+        affected, missing = await _plan_new_chapters(
+            follow.manga_id, lang, volume_name, names)
+        if missing:
+            # not built yet; keeping the cursor brings them back next run
+            log.warning("follow_chapters_unplanned", manga_id=follow.manga_id,
+                        language=lang, volume=volume_name, chapters=sorted(missing))
+            failed = True
+        for part, part_names in affected:
+            status = await scrape.get_mangadex_volume(
+                follow.prefix, follow.manga_id, lang, volume_name,
+                json.dumps(part_names), part, follow.data_saver, follow.profile)
+            builds.append((lang, names & set(part_names), {
+                "language": lang, "volume": volume_name, "part": part,
+                "chapters": sorted(names & set(part_names)),
+                "task_id": status["task_id"],
+            }))
+    for lang, names, build in builds:
+        build["status"] = await _wait_for_task(build["task_id"])
+        if build["status"] == "completed":
+            follow.known_chapters.setdefault(lang, []).extend(sorted(names))
+        else:
+            failed = True
+        ret["builds"].append(build)
+    # on failure keep the cursor so the next run asks for these chapters again
+    if failed:
+        ret["complete"] = False
+    elif feed:
+        follow.cursor = max(follow.cursor or "", max(ch["updatedAt"] for ch in feed))
+    return ret
+
+
+async def sync_follows() -> dict:
+    """
+    Incremental sync of every followed series. Series whose latest uploaded
+    chapter did not change are skipped without a feed request.
+    """
+    follows = list(_load_follows().values())
+    started = time.monotonic()
+    sync_state["progress"] = f"0/{len(follows)}"
+    latest = await get_latest_uploaded_chapters([f.manga_id for f in follows])
+    changed = [f for f in follows
+               if f.latest_uploaded_chapter is None
+               or latest.get(f.manga_id) != f.latest_uploaded_chapter]
+    results = []
+    done = 0
+
+    async def sync_one(follow: Follow):
+        nonlocal done
+        try:
+            res = await _sync_follow(follow)
+            if res["complete"]:
+                follow.latest_uploaded_chapter = latest.get(follow.manga_id)
+        except Exception as e:
+            log.error("follow_sync_failed", manga_id=follow.manga_id, error=e)
+            res = {"manga_id": follow.manga_id, "error": str(e)}
+        results.append(res)
+        done += 1
+        sync_state["progress"] = f"{done + len(follows) - len(changed)}/{len(follows)}"
+
+    await asyncio.gather(*(sync_one(f) for f in changed))
+    _save_follows()
+    summary = {
+        "followed": len(follows),
+        "skipped_unchanged": len(follows) - len(changed),
+        "checked": len(changed),
+        "new_chapters": sum(r.get("new_chapters", 0) for r in results),
+        "builds": [b for r in results for b in r.get("builds", [])],
+        "errors": [r for r in results if "error" in r],
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    log.info("follow_sync_completed", followed=summary["followed"],
+             checked=summary["checked"], new_chapters=summary["new_chapters"],
+             builds=len(summary["builds"]), seconds=summary["seconds"])
+    return summary
+
+
+async def _run_sync():
+    try:
+        summary = await sync_follows()
+        sync_state.update({"status": "completed", "summary": summary})
+    except Exception as e:
+        sync_state.update({"status": f"error: {str(e)}"})
+        log.error("follow_sync_failed", error=e)
+
+
+async def start_sync() -> dict:
+    """Start a background sync unless one is running; returns the sync state."""
+    if sync_state["status"] != "running":
+        sync_state.clear()
+        sync_state.update({"status": "running", "started": _now_cursor()})
+        asyncio.create_task(_run_sync())
+    return await get_sync_status()
+
+
+async def get_sync_status() -> dict:
+    return dict(sync_state)
@@ -15,31 +15,136 @@
  along with this program. If not, see <https://www.gnu.org/licenses/>.
  """
 
+import asyncio
 import base64
 import json
-from ..lib.mangadex_api import get_manga_info, get_volume_and_chapter_by_language_dict, get_manga_cover_256
-from calibre_plugins.store_mangadex import get_resources
+import re
+from ..lib.mangadex_api import (
+    get_manga_info, get_volumes_and_chapters, get_chapter_page_counts, get_manga_cover_256)
+from ..lib.events import get_logger
+from ..lib.transcode import TRANSCODE_PROFILES, DEFAULT_PROFILE
+from ..model.mangadex import VolumeInfo
 
-PAGE_TEMPLATE: str = (
-    get_resources('templates/download_page.tpl.html')
-    .decode('utf-8')
-)
+log = get_logger(__name__)
+
+PAGE_TEMPLATE: str | None = None
 
-max_volume_size = 20
 language_whitelist = ['en', 'es', 'es-la', 'ro']
 
+# Volumes are split into parts of roughly equal size, aiming for at most
+# part_target_bytes per CBZ. At-home responses carry no file sizes, so the
+# size is estimated from the feed's page counts (full quality, no transcode).
+part_target_bytes = 150 * 2**20
+page_bytes_estimate = 400 * 2**10
+# used for chapters the feed has no page count for
+default_chapter_pages = 20
+
+
+def file_prefix(title: str) -> str:
+    """CBZ file name prefix for a series, same as the detail page builds."""
+    return re.sub(r'[^a-z]', '', title.lower())
+
+
+def volume_parts(chapter_names: list[str], chapter_pages: list[int]) -> list[tuple[int, list[str]]]:
+    """
+    Split a volume's chapters (in reading order) into (part, chapter names)
+    of balanced estimated size; part 0 means the volume is not split.
+    """
+    total = sum(chapter_pages)
+    count = min(len(chapter_names),
+                -(-total * page_bytes_estimate // part_target_bytes))
+    if count <= 1:
+        return [(0, chapter_names)]
+    ret = []
+    start = 0
+    pages = 0
+    for i, n in enumerate(chapter_pages):
+        # cut when this chapter ends closer to the next boundary than it starts
+        boundary = total * (len(ret) + 1) / count
+        left = len(chapter_names) - i - 1
+        if (i > start and len(ret) < count - 1
+                and (pages + n / 2 >= boundary or left < count - len(ret) - 1)):
+            ret.append((len(ret) + 1, chapter_names[start:i]))
+            start = i
+        pages += n
+    ret.append((len(ret) + 1, chapter_names[start:]))
+    return ret
+
+
+def _chapter_pages(volume: VolumeInfo, page_counts: dict[str, int]) -> list[int]:
+    known = list(page_counts.values())
+    fallback = round(sum(known) / len(known)) if known else default_chapter_pages
+    return [next((page_counts[i] for i in c.chapter_id_variants if i in page_counts),
+                 fallback) for c in volume.chapters]
+
+
+async def get_volume_plan(manga_id: str, language: str) -> dict[str, list[dict]]:
+    """
+    Part plan of every volume in `language`: volume name -> parts, each with
+    the part number, chapter names, page count and estimated bytes.
+    """
+    volumes, page_counts = await asyncio.gather(
+        get_volumes_and_chapters(manga_id, language),
+        get_chapter_page_counts(manga_id, language),
+        return_exceptions=True)
+    if isinstance(volumes, BaseException):
+        raise volumes
+    if isinstance(page_counts, BaseException):
+        # still usable, every chapter just counts the same
+        log.warning("page_counts_failed", manga_id=manga_id, error=page_counts)
+        page_counts = {}
+    ret = {}
+    for volume in volumes:
+        pages = dict(zip((c.name for c in volume.chapters),
+                         _chapter_pages(volume, page_counts)))
+        names = [c.name for c in volume.chapters]
+        ret[volume.name] = [{
+            "part": part,
+            "chapters": part_names,
+            "pages": sum(pages[n] for n in part_names),
+            "estimated_bytes": sum(pages[n] for n in part_names) * page_bytes_estimate,
+        } for part, part_names in volume_parts(names, [pages[n] for n in names])]
+    return ret
+
+
+async def get_part_chapter_names(
+        manga_id: str, language: str, volume_name: str, part: int) -> list[str]:
+    """Chapter names of one planned part, for /to_cbz requests without a list."""
+    plan = await get_volume_plan(manga_id, language)
+    for p in plan.get(volume_name, []):
+        if p["part"] == part:
+            return p["chapters"]
+    raise ValueError(f"no part {part} in volume {volume_name}")
+
+
+def _get_page_template() -> str:
+    # read from the plugin ZIP on first use rather than at import
+    global PAGE_TEMPLATE
+    if PAGE_TEMPLATE is None:
+        from calibre_plugins.store_mangadex import get_resources
+        PAGE_TEMPLATE = get_resources(
+            'templates/download_page.tpl.html').decode('utf-8')
+    return PAGE_TEMPLATE
+
 
 async def get_manga_info_page(manga_id: str):
-    global language_whitelist, max_volume_size, PAGE_TEMPLATE
+    global language_whitelist
     manga_info = await get_manga_info(manga_id)
     page = manga_info.to_dict()
     thumbnail_data = await get_manga_cover_256(
         manga_id, manga_info.cover_id)
     page['cover_url'] = f"data:image/jpeg;base64,{base64.b64encode(thumbnail_data).decode('ascii')}"
     langs = [l for l in manga_info.translated_languages if l in language_whitelist]
+    plans = await asyncio.gather(*(get_volume_plan(manga_id, l) for l in langs))
     page['translated_languages'] = langs
-    page['volumes'] = await get_volume_and_chapter_by_language_dict(
-        manga_id, langs)
-    page['max_volume_size'] = max_volume_size
-    html_str = PAGE_TEMPLATE.replace('{/* manga_json */}', json.dumps(page))
+    page['volumes'] = {}
+    page['volume_plans'] = {}
+    for lang, plan in zip(langs, plans):
+        if not plan:
+            continue
+        page['volumes'][lang] = [v.to_dict() for v in await get_volumes_and_chapters(manga_id, lang)]
+        page['volume_plans'][lang] = plan
+    page['transcode_profiles'] = list(TRANSCODE_PROFILES.keys())
+    page['default_profile'] = DEFAULT_PROFILE
+    html_str = _get_page_template().replace('{/* manga_json */}', json.dumps(page))
     return html_str
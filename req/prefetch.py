@@ -0,0 +1,219 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from ..lib.mangadex_api import get_chapter_image_urls, get_manga_info, get_volumes_and_chapters
+from ..lib.utils import fetch_bytes, get_req_semaphore
+from ..lib.events import get_logger
+from ..lib.metrics import PREFETCH_BYTES
+from ..lib.integrity import IntegrityError, verify_page
+
+log = get_logger(__name__)
+
+# Speculative prefetch: once a detail page has been served, resolve the
+# at-home URLs of the first chapters of the first volume and download the
+# first pages, so a Download click does not start from scratch. It only runs
+# while nothing else is (no build in progress, request slots free) and any
+# user request cancels it. Prefetched data is used once; whatever expires
+# unused is counted as wasted, as are pages that fail verification and
+# downloads a cancellation caught in flight.
+
+prefetch_enabled = os.environ.get('MANGADEX_PREFETCH', '0') in ('1', 'true')
+prefetch_chapters = 3
+prefetch_pages = 6
+# at-home base URLs are only valid for a limited time
+prefetch_ttl = 600
+prefetch_max_bytes = 32 * 2**20
+# pause between speculative requests, leaving room in the API rate limit
+prefetch_pause = 0.25
+
+_at_home: dict[tuple[str, bool], tuple[float, list[str]]] = {}
+_pages: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+_pages_bytes = 0
+_task: asyncio.Task | None = None
+stats = {"runs": 0, "preempted": 0, "at_home_used": 0, "at_home_wasted": 0,
+         "pages_used": 0, "pages_wasted": 0}
+
+
+def _idle() -> bool:
+    from .scrape import tasks_status
+    if get_req_semaphore().locked():
+        return False
+    return not any(s in ("scheduled", "running") for s, _ in tasks_status.values())
+
+
+def _count_wasted(size: int):
+    stats["pages_wasted"] += 1
+    PREFETCH_BYTES.inc(size, result="wasted")
+
+
+def _waste_page(url: str):
+    global _pages_bytes
+    _, data = _pages.pop(url)
+    _pages_bytes -= len(data)
+    _count_wasted(len(data))
+
+
+def _expire():
+    now = time.monotonic()
+    for key in [k for k, (t, _) in _at_home.items() if now - t >= prefetch_ttl]:
+        del _at_home[key]
+        stats["at_home_wasted"] += 1
+    for url in [u for u, (t, _) in _pages.items() if now - t >= prefetch_ttl]:
+        _waste_page(url)
+
+
+def take_chapter_urls(chapter_id: str, data_saver: bool) -> list[str] | None:
+    """Return (once) prefetched at-home page URLs for a chapter, if still fresh."""
+    _expire()
+    entry = _at_home.pop((chapter_id, data_saver), None)
+    if entry is None:
+        return None
+    stats["at_home_used"] += 1
+    return entry[1]
+
+
+def take_page(url: str) -> bytes | None:
+    """Return (once) a prefetched page body."""
+    global _pages_bytes
+    entry = _pages.pop(url, None)
+    if entry is None:
+        return None
+    _pages_bytes -= len(entry[1])
+    stats["pages_used"] += 1
+    PREFETCH_BYTES.inc(len(entry[1]), result="used")
+    return entry[1]
+
+
+def _store_page(url: str, data: bytes):
+    global _pages_bytes
+    _pages[url] = (time.monotonic(), data)
+    _pages_bytes += len(data)
+    while _pages_bytes > prefetch_max_bytes and _pages:
+        _waste_page(next(iter(_pages)))
+
+
+async def _wait_idle():
+    while not _idle():
+        await asyncio.sleep(prefetch_pause)
+    await asyncio.sleep(prefetch_pause)
+
+
+async def _fetch_page(url: str, started: asyncio.Event) -> bytes:
+    async with get_req_semaphore():
+        started.set()
+        return await fetch_bytes(url)
+
+
+def _wasted_fetch_done(fetch: asyncio.Task):
+    if not fetch.cancelled() and fetch.exception() is None:
+        _count_wasted(len(fetch.result()))
+
+
+async def _prefetch(manga_id: str):
+    from .manga_info import language_whitelist
+    info = await get_manga_info(manga_id)
+    # the detail page lists languages in this order; assume the first one
+    language = next((l for l in info.translated_languages or []
+                     if l in language_whitelist), None)
+    if language is None:
+        return
+    volumes = await get_volumes_and_chapters(manga_id, language)
+    if not volumes:
+        return
+    chapters = volumes[0].chapters[:prefetch_chapters]
+    for i, chapter in enumerate(chapters):
+        chapter_id = chapter.chapter_id_variants[0]
+        if (chapter_id, False) in _at_home:
+            continue
+        await _wait_idle()
+        urls = await get_chapter_image_urls(chapter_id, False)
+        _at_home[(chapter_id, False)] = (time.monotonic(), urls)
+        if i > 0:
+            continue
+        # first pages of the first chapter
+        for url in urls[:prefetch_pages]:
+            if url in _pages:
+                continue
+            await _wait_idle()
+            started = asyncio.Event()
+            fetch = asyncio.ensure_future(_fetch_page(url, started))
+            try:
+                data = await asyncio.shield(fetch)
+            except asyncio.CancelledError:
+                if started.is_set():
+                    # the executor thread downloads the page anyway; count
+                    # it as wasted once it is in
+                    fetch.add_done_callback(_wasted_fetch_done)
+                else:
+                    fetch.cancel()
+                raise
+            try:
+                verify_page(url, data)
+            except IntegrityError:
+                # the build downloads it again
+                _count_wasted(len(data))
+                continue
+            _store_page(url, data)
+    log.debug("prefetch_done", manga_id=manga_id, language=language,
+              chapters=len(chapters), cached_bytes=_pages_bytes)
+
+
+def _done(task: asyncio.Task):
+    global _task
+    if _task is task:
+        _task = None
+    if not task.cancelled() and task.exception() is not None:
+        log.info("prefetch_failed", error=task.exception())
+
+
+def schedule(manga_id: str):
+    """Start prefetching for a detail page that was just served."""
+    global _task
+    if not prefetch_enabled:
+        return
+    preempt(count=False)
+    _expire()
+    stats["runs"] += 1
+    _task = asyncio.get_running_loop().create_task(_prefetch(manga_id))
+    _task.add_done_callback(_done)
+
+
+def preempt(count: bool = True):
+    """Cancel a running prefetch; called for every real user request."""
+    if _task is not None and not _task.done():
+        _task.cancel()
+        if count:
+            stats["preempted"] += 1
+            log.debug("prefetch_preempted")
+
+
+async def get_prefetch_status() -> dict:
+    _expire()
+    return {
+        "enabled": prefetch_enabled,
+        "running": _task is not None and not _task.done(),
+        "cached_chapters": len(_at_home),
+        "cached_pages": len(_pages),
+        "cached_bytes": _pages_bytes,
+        "used_bytes": PREFETCH_BYTES.values.get(("used",), 0),
+        "wasted_bytes": PREFETCH_BYTES.values.get(("wasted",), 0),
+        **stats,
+    }
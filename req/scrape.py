@@ -20,21 +20,46 @@ import asyncio
 import hashlib
 import json
 import os
-import io
+import time
+from collections import OrderedDict
 from urllib.parse import unquote, urlparse
 from ..lib.mangadex_api import get_manga_info, get_volumes_and_chapters, get_chapter_image_urls
-from ..lib.utils import download_bytes, ensure_image_vertical, delete_files_older_than
+from ..lib.utils import (
+    fetch_bytes, get_req_semaphore, LatencyTracker, first_successful,
+    retry_with_backoff)
+from ..lib.cache import CBZ_CACHE, PAGE_CACHE, get_cache, run_io
+from ..lib.integrity import IntegrityError, verify_page
+from ..lib.transcode import (
+    TRANSCODE_PROFILES, DEFAULT_PROFILE, get_transcode_executor, transcode_page)
+from ..lib.metrics import (
+    CACHE_REQUESTS, PAGE_INTEGRITY_FAILURES, SEMAPHORE_WAIT_SECONDS, PAGES_DOWNLOADED,
+    TASK_PAGES_PER_SECOND)
+from ..lib.tracing import TaskTrace, current_trace, current_lane, trace_span, trace_event
+from ..lib.events import get_logger
+from .prefetch import take_chapter_urls, take_page
 from typing import Dict, Tuple
 from calibre.utils.zipfile import ZipFile
-from calibre.utils.config import config_dir
+
+log = get_logger(__name__)
 
 parallel_worker_limit = 1
-PLUGIN_ID = 'MangaDex'
-CACHE_DIR = os.path.join(
-    config_dir, 'plugins', PLUGIN_ID, 'cbz_cache')
-os.makedirs(CACHE_DIR, exist_ok=True)
+# worker processes for volume builds, 0 builds on the local event loop
+shard_processes = int(os.environ.get('MANGADEX_SHARDS', '0') or 0)
+# Page download resilience: attempts per page, failed attempts before asking
+# MangaDex for a fresh at-home node, and the latency quantile after which a
+# duplicate (hedged) request is fired for a straggling page.
+page_retry_limit = 5
+page_failover_after = 2
+# re-downloads of a page that passed the integrity checks but did not decode
+page_decode_retries = 1
+hedge_percentile = 0.95
+hedge_min_delay = 1.0
+page_latency = LatencyTracker()
+# traces of the most recent volume builds kept for /task_status and /task/.../trace
+trace_history = 64
 
 tasks_status: Dict[str, Tuple[str, str]] = {}
+tasks_trace: "OrderedDict[str, TaskTrace]" = OrderedDict()
 worker_semaphore = None
 
 def get_worker_semaphore() -> asyncio.Semaphore:
@@ -45,29 +70,79 @@ def get_worker_semaphore() -> asyncio.Semaphore:
         worker_semaphore = asyncio.Semaphore(parallel_worker_limit)
         return worker_semaphore
 
+class AtHomeFailover:
+    """
+    Keeps the current URL of every page of a volume build and swaps a whole
+    chapter over to a fresh at-home node when its pages keep failing.
+    """
+
+    def __init__(self, data_saver: bool = False):
+        self.data_saver = data_saver
+        self.urls: Dict[str, str] = {}
+        self.chapter_pages: Dict[str, list[str]] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+    def register(self, chapter_id: str, urls: list[str]):
+        self.chapter_pages[chapter_id] = list(urls)
+
+    def current(self, url: str) -> str:
+        return self.urls.get(url, url)
+
+    async def refresh(self, chapter_id: str, failed_url: str):
+        lock = self.locks.setdefault(chapter_id, asyncio.Lock())
+        async with lock:
+            pages = self.chapter_pages.get(chapter_id, [])
+            if failed_url not in (self.current(u) for u in pages):
+                # another page of this chapter already moved to a new node
+                return
+            log.info("at_home_refresh", chapter_id=chapter_id, failed_url=failed_url)
+            with trace_span("at_home_refresh", chapter_id=chapter_id):
+                fresh = await get_chapter_image_urls(chapter_id, self.data_saver)
+            by_name = {os.path.basename(urlparse(u).path): u for u in fresh}
+            for u in pages:
+                name = os.path.basename(urlparse(u).path)
+                if name in by_name:
+                    self.urls[u] = by_name[name]
+
+
 async def get_chapter_image_urls_with_fallback(
-        chapter_id_variants: list[str], page_prefix: str) -> list[(str, str)]:
+        chapter_id_variants: list[str], page_prefix: str,
+        failover: AtHomeFailover) -> list[(str, str, str)]:
     image_urls = []
     for chapter_id in chapter_id_variants:
-        image_urls = await get_chapter_image_urls(chapter_id)
+        with trace_span("at_home", chapter_id=chapter_id) as span:
+            image_urls = take_chapter_urls(chapter_id, failover.data_saver)
+            if image_urls is None:
+                image_urls = await get_chapter_image_urls(
+                    chapter_id, failover.data_saver)
+            elif span:
+                span.attrs["prefetched"] = True
+            if span:
+                span.attrs["pages"] = len(image_urls)
         if len(image_urls) > 0:
             break
-    return [(i, page_prefix) for i in image_urls]
+    failover.register(chapter_id, image_urls)
+    return [(i, page_prefix, chapter_id) for i in image_urls]
 
 
 async def prepare_manga_metadata(
-        manga_id: str, volume_name: str, lang: str, chapter_names: list[str], part: int, my_zip) -> list[(str, str)]:
-    manga_info = await get_manga_info(manga_id)
-    volumes = await get_volumes_and_chapters(manga_id, lang)
-    volume = next((v for v in volumes if v.name == volume_name))
-    chapters = [c for c in volume.chapters if c.name in chapter_names]
+        manga_id: str, volume_name: str, lang: str, chapter_names: list[str], part: int,
+        my_zip, failover: AtHomeFailover) -> list[(str, str, str)]:
+    with trace_span("manga_info"):
+        manga_info = await get_manga_info(manga_id)
+    with trace_span("aggregate"):
+        volumes = await get_volumes_and_chapters(manga_id, lang)
+    volume = volumes.get_volume(volume_name)
+    if volume is None:
+        raise ValueError(f"manga {manga_id} has no volume {volume_name!r} in {lang}")
+    chapters = volume.get_chapters(chapter_names)
     tasks = []
     image_urls = []
     for chapter in chapters:
         padded_chapter_index = f"{volume_name}/{chapter.sort:09.2f}/"
         tasks.append(asyncio.create_task(
             get_chapter_image_urls_with_fallback(
-                chapter.chapter_id_variants, padded_chapter_index)))
+                chapter.chapter_id_variants, padded_chapter_index, failover)))
     for t in tasks:
         image_urls += await t
     my_zip.writestr("ComicInfo.xml",
@@ -78,79 +153,313 @@ async def prepare_manga_metadata(
     return image_urls
 
 
-def _get_image_filename(url, chapter_prefix, img_index):
+def _get_image_filename(url, chapter_prefix, img_index, extension=None, slice_index=None):
     parsed_url = urlparse(url)
     padded_index = f"{img_index + 1:04d}"
-    return chapter_prefix + "_" + padded_index + \
-        "_" + unquote(os.path.basename(parsed_url.path))
+    base_name = unquote(os.path.basename(parsed_url.path))
+    if extension is not None:
+        base_name = os.path.splitext(base_name)[0]
+        if slice_index is not None:
+            base_name += f"_{slice_index + 1:02d}"
+        base_name += "." + extension
+    return chapter_prefix + "_" + padded_index + "_" + base_name
+
+
+class PageVerifier:
+    """
+    Integrity checks for one page across its attempts. A SHA-256 mismatch is
+    accepted only once two different at-home nodes served the same bytes,
+    i.e. the file name hash is not the content hash for this upload.
+    """
+
+    def __init__(self):
+        self.mismatches: Dict[str, set] = {}
+        # the last attempt returned bad bytes, so move to a fresh node
+        self.failed = False
+
+    def __call__(self, url: str, data: bytes):
+        try:
+            verify_page(url, data)
+        except IntegrityError as e:
+            if e.reason == "sha256":
+                hosts = self.mismatches.setdefault(e.digest, set())
+                hosts.add(urlparse(url).netloc)
+                if len(hosts) > 1:
+                    log.warning("page_hash_mismatch_accepted", url=url)
+                    return
+            self.reject(url, e)
+            raise
+
+    def reject(self, url: str, e: IntegrityError):
+        self.failed = True
+        PAGE_INTEGRITY_FAILURES.inc(reason=e.reason)
+        trace_event("integrity_failed", reason=e.reason)
+        log.warning("page_integrity_failed", url=url, reason=e.reason, error=e)
+
+
+async def _download_page_attempt(
+        url: str, started: asyncio.Event, verify: PageVerifier) -> bytes:
+    wait_start = time.monotonic()
+    async with get_req_semaphore():
+        SEMAPHORE_WAIT_SECONDS.observe(
+            time.monotonic() - wait_start, semaphore="request")
+        started.set()
+        start = time.monotonic()
+        try:
+            data = await fetch_bytes(url)
+        except IntegrityError as e:
+            verify.reject(url, e)
+            raise
+    page_latency.add(time.monotonic() - start)
+    verify(url, data)
+    return data
+
 
+async def _download_page_hedged(url: str, verify: PageVerifier) -> bytes:
+    """
+    Download a page; if it takes longer than the observed p95 page latency,
+    fire a duplicate request and keep whichever answers first.
+    """
+    started = asyncio.Event()
+    tasks = [asyncio.create_task(_download_page_attempt(url, started, verify))]
+    try:
+        delay = page_latency.percentile(hedge_percentile)
+        if delay is not None:
+            await started.wait()
+            done, _ = await asyncio.wait(
+                tasks, timeout=max(delay, hedge_min_delay))
+            if not done:
+                log.debug("hedge", url=url, after_ms=round(delay * 1000, 3))
+                trace_event("hedge", after_ms=round(delay * 1000, 3))
+                tasks.append(asyncio.create_task(
+                    _download_page_attempt(url, asyncio.Event(), verify)))
+        return await first_successful(tasks)
+    finally:
+        # also when cancelled before first_successful took over the attempts
+        for t in tasks:
+            if not t.done():
+                t.cancel()
 
-async def download_image_to_zip(image_url: str, chapter_prefix: str, index: int, my_zip):
-    file_name = _get_image_filename(image_url, chapter_prefix, index)
-    print('downloading', image_url)
-    image_data = io.BytesIO(await download_bytes(image_url))
-    print('downloading', image_url, 'done')
-    rotated_io = ensure_image_vertical(image_data)
-    my_zip.writestr(file_name, rotated_io.getvalue())
 
+def _page_cache_key(image_url: str) -> str:
+    # {base}/{quality}/{chapter hash}/{file}; the at-home node does not matter
+    return ".".join(urlparse(image_url).path.rsplit("/", 3)[-3:])
 
-def get_file_name(prefix: str, volume_name: str, part: int, language: str, manga_id: str):
-    return ".".join([prefix, volume_name, str(part), language, manga_id, "cbz"])
+
+async def _stored_page(image_url: str) -> bytes | None:
+    """A prefetched or cached copy of the page, if one passes verification."""
+    cache = get_cache()
+    data = take_page(image_url)
+    if data is not None:
+        trace_event("prefetched", bytes=len(data))
+    elif cache.cache_pages:
+        data = await run_io(cache.get, PAGE_CACHE, _page_cache_key(image_url))
+        CACHE_REQUESTS.inc(cache="page", result="miss" if data is None else "hit")
+        if data is not None:
+            trace_event("page_cache_hit", bytes=len(data))
+    if data is None:
+        return None
+    try:
+        verify_page(image_url, data)
+    except IntegrityError as e:
+        # downloaded again below and replaced in the cache
+        log.warning("stored_page_rejected", url=image_url, reason=e.reason)
+        return None
+    return data
+
+
+async def download_page_bytes(
+        image_url: str, chapter_id: str, failover: AtHomeFailover,
+        verify: PageVerifier | None = None) -> bytes:
+    """Download and verify a page, moving to a fresh at-home node after bad bytes."""
+    verify = verify or PageVerifier()
+    used_urls = []
+
+    async def attempt(n: int) -> bytes:
+        if n > 0:
+            trace_event("retry", attempt=n)
+        if used_urls and (verify.failed or n >= page_failover_after):
+            await failover.refresh(chapter_id, used_urls[-1])
+        verify.failed = False
+        used_urls.append(failover.current(image_url))
+        return await _download_page_hedged(used_urls[-1], verify)
+
+    return await retry_with_backoff(attempt, attempts=page_retry_limit)
+
+
+async def download_image_to_zip(
+        image_url: str, chapter_prefix: str, chapter_id: str, index: int,
+        my_zip, failover: AtHomeFailover, profile: str = DEFAULT_PROFILE):
+    current_lane.set(index + 1)
+    cache = get_cache()
+    image_data = await _stored_page(image_url)
+    stored = image_data is not None
+    verify = PageVerifier()
+    for decode_attempt in range(page_decode_retries + 1):
+        if image_data is None:
+            with trace_span("download") as span:
+                image_data = await download_page_bytes(
+                    image_url, chapter_id, failover, verify)
+                if span:
+                    span.attrs["bytes"] = len(image_data)
+        # image processing is CPU bound, keep it off the event loop thread
+        try:
+            with trace_span("process", profile=profile):
+                pages = await asyncio.get_running_loop().run_in_executor(
+                    get_transcode_executor(), transcode_page, image_data,
+                    TRANSCODE_PROFILES[profile])
+            break
+        except Exception as e:
+            # passed the cheap checks but does not decode: fetch it again
+            if decode_attempt == page_decode_retries:
+                raise
+            verify.reject(failover.current(image_url), IntegrityError("decode", str(e)))
+            await failover.refresh(chapter_id, failover.current(image_url))
+            image_data, stored = None, False
+    # only bytes that decoded are shared with other builds
+    if not stored and cache.cache_pages:
+        await run_io(cache.put, PAGE_CACHE, _page_cache_key(image_url), image_data)
+    with trace_span("zip_write", files=len(pages)):
+        for slice_index, (extension, data) in enumerate(pages):
+            file_name = _get_image_filename(
+                image_url, chapter_prefix, index, extension,
+                slice_index if len(pages) > 1 else None)
+            my_zip.writestr(file_name, data)
+    log.debug("page_written", chapter_id=chapter_id, index=index, files=len(pages))
+
+
+def get_file_name(prefix: str, volume_name: str, part: int, language: str, manga_id: str,
+                  data_saver: bool = False, profile: str = DEFAULT_PROFILE):
+    # builds of the same volume are cached separately per quality and profile
+    quality = "ds" if data_saver else "hq"
+    return ".".join([prefix, volume_name, str(part), language, quality, profile,
+                     manga_id, "cbz"])
 
 
 async def put_mangadex_volume(
         task_id: str, prefix: str, manga_id: str, language: str,
-        volume_name: str, chapter_names: list[str], part: int):
-    global CACHE_DIR
-    async with get_worker_semaphore():
+        volume_name: str, chapter_names: list[str], part: int,
+        data_saver: bool = False, profile: str = DEFAULT_PROFILE):
+    trace = tasks_trace[task_id] = TaskTrace(task_id)
+    tasks_trace.move_to_end(task_id)
+    while len(tasks_trace) > trace_history:
+        tasks_trace.popitem(last=False)
+    current_trace.set(trace)
+    wait_start = time.monotonic()
+    cache = get_cache()
+    zip_file_name = task_id + "." + get_file_name(
+        prefix, volume_name, part, language, manga_id, data_saver, profile)
+    try:
+        # another process may be building the same file
+        async with cache.lock(CBZ_CACHE, task_id) as waited:
+            if waited:
+                trace_event("cache_lock_waited")
+                if await run_io(cache.find, CBZ_CACHE, zip_file_name):
+                    CACHE_REQUESTS.inc(cache="cbz", result="hit")
+                    tasks_status[task_id] = ("completed", f"/download/{task_id}")
+                    log.info("task_cache_hit", task_id=task_id, waited=True)
+                    return
+            await _build_volume(
+                task_id, zip_file_name, manga_id, language, volume_name,
+                chapter_names, part, data_saver, profile, wait_start)
+    except Exception as e:
+        tasks_status[task_id] = (f"error: {str(e)}", "")
+        log.error("task_failed", task_id=task_id, error=e)
+
+
+async def _build_volume(
+        task_id: str, zip_file_name: str, manga_id: str, language: str,
+        volume_name: str, chapter_names: list[str], part: int,
+        data_saver: bool, profile: str, wait_start: float):
+    cache = get_cache()
+    with trace_span("queued"):
+        await get_worker_semaphore().acquire()
+    try:
+        SEMAPHORE_WAIT_SECONDS.observe(
+            time.monotonic() - wait_start, semaphore="worker")
         tasks_status[task_id] = ("running", "")
+        await run_io(cache.purge, CBZ_CACHE)
+        await run_io(cache.purge, PAGE_CACHE)
+        zip_file_path = await run_io(cache.new_file, CBZ_CACHE)
         try:
-            delete_files_older_than(CACHE_DIR, hours=12)
-            zip_file_name = get_file_name(
-                prefix, volume_name, part, language, manga_id)
-            zip_file_name = task_id + "." + zip_file_name
-            zip_file_path = os.path.join(CACHE_DIR, zip_file_name)
+            failover = AtHomeFailover(data_saver)
             with ZipFile(zip_file_path, mode='w') as my_zip:
                 image_urls = await prepare_manga_metadata(
-                    manga_id, volume_name, language, chapter_names, part, my_zip)
+                    manga_id, volume_name, language, chapter_names, part,
+                    my_zip, failover)
                 total_images = len(image_urls)
                 completed = 0
+                pages_start = time.monotonic()
                 tasks = [
                     asyncio.create_task(
                         download_image_to_zip(
-                            url, prefix, index, my_zip
+                            url, prefix, chapter_id, index, my_zip, failover,
+                            profile
                         )
                     )
-                    for index, (url, prefix) in enumerate(image_urls)
+                    for index, (url, prefix, chapter_id) in enumerate(image_urls)
                 ]
-                for task in asyncio.as_completed(tasks):
-                    await task
-                    completed += 1
-                    tasks_status[task_id] = (
-                        "running", f"{completed}/{total_images}")
-            tasks_status[task_id] = (
-                "completed", f"/download/{task_id}")
-        except Exception as e:
-            tasks_status[task_id] = (f"error: {str(e)}", "")
+                try:
+                    for task in asyncio.as_completed(tasks):
+                        await task
+                        completed += 1
+                        PAGES_DOWNLOADED.inc()
+                        TASK_PAGES_PER_SECOND.set(
+                            completed / max(time.monotonic() - pages_start, 1e-6),
+                            task_id=task_id)
+                        tasks_status[task_id] = (
+                            "running", f"{completed}/{total_images}")
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    TASK_PAGES_PER_SECOND.remove(task_id=task_id)
+            await run_io(cache.publish, CBZ_CACHE, zip_file_name, zip_file_path)
+        except BaseException:
+            await run_io(cache.discard, zip_file_path)
+            raise
+        tasks_status[task_id] = (
+            "completed", f"/download/{task_id}")
+        log.info("task_completed", task_id=task_id, pages=completed,
+                 seconds=round(time.monotonic() - wait_start, 3))
+    finally:
+        get_worker_semaphore().release()
 
 
 async def get_mangadex_volume(
         prefix: str, manga_id: str, language: str,
-        volume_name: str, chapter_names: str, part: int = 0):
-    zip_file_name = get_file_name(prefix, volume_name, part, language, manga_id)
-    task_id = hashlib.sha256(zip_file_name.encode()).hexdigest()
+        volume_name: str, chapter_names: str, part: int = 0,
+        data_saver: bool = False, profile: str = DEFAULT_PROFILE):
+    if profile not in TRANSCODE_PROFILES:
+        raise ValueError(f"unknown transcode profile: {profile}")
+    zip_file_name = get_file_name(
+        prefix, volume_name, part, language, manga_id, data_saver, profile)
     chapter_names_decoded = json.loads(chapter_names)
+    # a part that gained chapters is a different build
+    task_id = hashlib.sha256(
+        (zip_file_name + json.dumps(chapter_names_decoded)).encode()).hexdigest()
     (status, _res) = tasks_status.get(task_id, ("unknown task", ""))
     if status not in ("scheduled", "running"):
+        cached = await run_io(get_cache().find, CBZ_CACHE, task_id + "." + zip_file_name)
+        CACHE_REQUESTS.inc(cache="cbz", result="miss" if cached is None else "hit")
+        if cached is not None:
+            tasks_status[task_id] = ("completed", f"/download/{task_id}")
+            return await get_task_status(task_id)
         tasks_status[task_id] = ("scheduled", "")
-        asyncio.create_task(
-            put_mangadex_volume(
-                task_id, prefix, manga_id, language,
-                volume_name, chapter_names_decoded, part))
+        if shard_processes > 0:
+            from .shards import get_pool
+            get_pool().submit(task_id, [
+                prefix, manga_id, language, volume_name,
+                chapter_names_decoded, part, data_saver, profile])
+        else:
+            asyncio.create_task(
+                put_mangadex_volume(
+                    task_id, prefix, manga_id, language,
+                    volume_name, chapter_names_decoded, part, data_saver,
+                    profile))
     return await get_task_status(task_id)
 
 
-async def get_task_status(task_id: str):
+async def get_task_status(task_id: str, timeline: bool = False):
     global tasks_status
     (status, res) = tasks_status.get(task_id, ("unknown task", ""))
     ret = {
@@ -161,17 +470,25 @@ async def get_task_status(task_id: str):
         ret["url"] = res
     if status == "running":
         ret["progress"] = res
+    trace = tasks_trace.get(task_id)
+    if trace is not None:
+        ret["phases"] = trace.summary()
+        if timeline:
+            ret["timeline"] = trace.to_timeline()
     return ret
 
 
+async def get_task_chrome_trace(task_id: str) -> dict | None:
+    trace = tasks_trace.get(task_id)
+    return trace.to_chrome_trace() if trace is not None else None
+
+
 def get_cbz_file_path(task_id: str):
-    global CACHE_DIR
+    cache = get_cache()
     fname = next((
-        fn for fn in os.listdir(CACHE_DIR)
-        if fn.startswith(f"{task_id}.") and
-        os.path.isfile(os.path.join(CACHE_DIR, fn))), None)
-    if fname == None:
+        fn for fn in cache.keys(CBZ_CACHE) if fn.startswith(f"{task_id}.")), None)
+    file_path = fname and cache.find(CBZ_CACHE, fname)
+    if not file_path:
         raise Exception("file not found")
     original_name = fname.split('.', 1)[1]
-    file_path = os.path.join(CACHE_DIR, fname)
     return (file_path, original_name)
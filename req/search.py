@@ -17,14 +17,12 @@
 
 import asyncio
 import base64
-import logging
 import re
 from ..lib.mangadex_api import get_tags, search_manga, get_manga_cover_96_cached
+from ..lib.events import get_logger
+from ..lib.search_index import search_local
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger(__name__)
+log = get_logger(__name__)
 
 
 def _normalize_tag(s: str) -> str:
@@ -60,13 +58,54 @@ def _normalize_title(s: str) -> str:
                   re.sub(r'[^\x00-\x7F]+', '', s.replace("×", " x ")))
 
 
-async def search_for_manga_dict(
-        query: str, included_tags: list[str], excluded_tags: list[str], max_results: int) -> list[dict]:
+def _matches_filters(manga, included_tags: list[str], excluded_tags: list[str],
+                     content_ratings: list[str]) -> bool:
+    """Apply the live query's tag and content rating filters to an index hit."""
+    tags = [_normalize_tag(t) for t in manga.tags]
+    return (
+        manga.content_rating in content_ratings
+        and all(any(_normalize_tag(p) in t for t in tags) for p in included_tags)
+        and not any(_normalize_tag(p) in t for p in excluded_tags for t in tags)
+    )
+
+
+async def _search_live(
+        query: str, included_tags: list[str], excluded_tags: list[str],
+        content_ratings: list[str], max_results: int) -> list:
     included_tag_ids = await _get_matching_tag_ids(included_tags)
     excluded_tag_ids = await _get_matching_tag_ids(excluded_tags)
-    content_ratings = _get_matching_content_ratings(excluded_tags)
-    search_result = await search_manga(
+    # search_manga adds every result to the local index
+    return await search_manga(
         query, included_tag_ids, excluded_tag_ids, content_ratings, max_results)
+
+
+_background_refreshes: set[asyncio.Task] = set()
+
+
+def _refresh_done(task: asyncio.Task):
+    _background_refreshes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.warning("search_refresh_failed", error=task.exception())
+
+
+async def search_for_manga_dict(
+        query: str, included_tags: list[str], excluded_tags: list[str], max_results: int) -> list[dict]:
+    content_ratings = _get_matching_content_ratings(excluded_tags)
+    live = asyncio.create_task(_search_live(
+        query, included_tags, excluded_tags, content_ratings, max_results))
+    local = [
+        m for m in search_local(query, max_results * 3)
+        if _matches_filters(m, included_tags, excluded_tags, content_ratings)
+    ][:max_results]
+    if local:
+        # answer from the index right away; the live query still runs and
+        # merges new hits into the index for the next search
+        log.debug("search_local_hit", q=query, results=len(local))
+        _background_refreshes.add(live)
+        live.add_done_callback(_refresh_done)
+        search_result = local
+    else:
+        search_result = await live
     ret = []
     thumbnail_data_tasks = {}
     for mi in search_result:
@@ -79,7 +118,12 @@ async def search_for_manga_dict(
             "cover_url": ""
         })
     for m in ret:
-        thumbnail_data = await thumbnail_data_tasks[m["manga_id"]]
+        try:
+            thumbnail_data = await thumbnail_data_tasks[m["manga_id"]]
+        except Exception as e:
+            # a missing cover should not fail a search answered from the index
+            log.warning("thumbnail_failed", manga_id=m["manga_id"], error=e)
+            continue
         m["cover_url"] = f"data:image/jpeg;base64,{base64.b64encode(thumbnail_data).decode('ascii')}"
     return ret
 
@@ -89,6 +133,6 @@ async def search_for_manga_by_user_query_dict(q: str, max_results: int) -> list[
     tag_incl = [w for w in query_words if w[0] == '+']
     tag_excl = [w for w in query_words if w[0] == '-']
     q = " ".join([w for w in query_words if w[0] not in ['-', '+']])
-    logger.info(f"q: {q} incl: {tag_incl} excl: {tag_excl}")
+    log.info("search", q=q, include=tag_incl, exclude=tag_excl)
     ret = await search_for_manga_dict(q, tag_incl, tag_excl, max_results)
     return ret
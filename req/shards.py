@@ -0,0 +1,315 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+from urllib.parse import urlparse
+from ..lib import cache, mangadex_api, utils
+from ..lib.events import get_logger
+from ..lib.metrics import PAGES_DOWNLOADED, UPSTREAM_BYTES
+from . import scrape
+
+log = get_logger(__name__)
+
+# Optional sharded mode: volume builds are spread over worker processes, each
+# with its own event loop, so JSON parsing, ZIP writing and Pillow run in
+# parallel. The parent stays the task registry (workers stream status lines
+# back into scrape.tasks_status) and owns the token bucket every MangaDex API
+# request in every process has to pass, so the API rate limit still holds.
+#
+# Messages are JSON lines over the worker's stdin/stdout:
+#   parent -> worker: init, build, grant, stop
+#   worker -> parent: status, acquire, metrics
+
+# MangaDex allows about 5 API requests per second per client
+api_rate_limit = 5.0
+# parallel requests the parent keeps for search, detail pages and covers;
+# the workers split the rest of utils.parallel_request_limit
+parent_request_share = 2
+status_interval = 0.25
+
+# run inside calibre-parallel, which sets up calibre but not the plugins
+WORKER_COMMAND = (
+    "from calibre.customize.ui import initialized_plugins; initialized_plugins(); "
+    "from calibre_plugins.store_mangadex.req.shards import worker_main; worker_main()"
+)
+
+pool: "ShardPool | None" = None
+
+
+def _api_host() -> str:
+    return urlparse(mangadex_api.MANGADEX_API_URL).netloc
+
+
+def _spawn_worker() -> subprocess.Popen:
+    from calibre.utils.ipc.simple_worker import start_pipe_worker
+    return start_pipe_worker(
+        WORKER_COMMAND, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+
+class ShardProcess:
+    """Parent-side handle of one worker process."""
+
+    def __init__(self, index: int, slot: int, pool: "ShardPool"):
+        self.index = index
+        # position in the pool, reused by the worker that replaces this one
+        self.slot = slot
+        self.pool = pool
+        self.inflight: set[str] = set()
+        self.alive = True
+        self._lock = threading.Lock()
+        self.proc = _spawn_worker()
+        threading.Thread(
+            target=self._read, name=f"mangadex-shard-{index}", daemon=True).start()
+
+    def send(self, msg: dict):
+        try:
+            with self._lock:
+                self.proc.stdin.write((json.dumps(msg) + "\n").encode("utf-8"))
+                self.proc.stdin.flush()
+        except (OSError, ValueError):
+            self.pool.loop.call_soon_threadsafe(self.pool.exited, self)
+
+    def _read(self):
+        try:
+            for line in self.proc.stdout:
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                self.pool.loop.call_soon_threadsafe(self.pool.handle, self, msg)
+            self.pool.loop.call_soon_threadsafe(self.pool.exited, self)
+        except RuntimeError:
+            # the parent's event loop is already closed
+            pass
+
+
+class ShardPool:
+    def __init__(self, processes: int, loop: asyncio.AbstractEventLoop):
+        limit = utils.parallel_request_limit
+        self.parent_requests = max(1, min(parent_request_share, limit - 1))
+        self.worker_requests = max(1, limit - self.parent_requests)
+        if processes > self.worker_requests:
+            # every worker needs at least one of the parallel requests
+            log.warning("shard_processes_capped", processes=processes,
+                        request_limit=limit, worker_requests=self.worker_requests)
+            processes = self.worker_requests
+        self.processes = processes
+        # the parent's semaphore is part of the split, not on top of it
+        utils.req_semaphore = asyncio.Semaphore(self.parent_requests)
+        self.loop = loop
+        self.workers: list[ShardProcess] = []
+        self.api_rate = utils.RateLimiter(api_rate_limit)
+        self._index = itertools.count()
+        # the parent's own API requests (search, detail pages) share the bucket
+        utils.upstream_gate = self._local_gate
+
+    async def _local_gate(self, url: str):
+        if urlparse(url).netloc == _api_host():
+            await self.api_rate.acquire()
+
+    def _ensure_workers(self):
+        self.workers = [w for w in self.workers if w.alive]
+        used = {w.slot for w in self.workers}
+        for slot in range(self.processes):
+            if slot in used:
+                continue
+            worker = ShardProcess(next(self._index), slot, self)
+            worker.send({
+                "op": "init",
+                "cache": cache.get_cache().to_spec(),
+                "api_url": mangadex_api.MANGADEX_API_URL,
+                "covers_url": mangadex_api.MANGADEX_COVERS_URL,
+                # the request budget is split so the total stays the same
+                "request_limit": self._request_limit(slot),
+                "worker_limit": scrape.parallel_worker_limit,
+            })
+            self.workers.append(worker)
+            log.info("shard_started", index=worker.index, pid=worker.proc.pid)
+
+    def _request_limit(self, slot: int) -> int:
+        limit, n = self.worker_requests, self.processes
+        return limit // n + (slot < limit % n)
+
+    def submit(self, task_id: str, args: list):
+        """Send a put_mangadex_volume job to the least busy worker."""
+        self._ensure_workers()
+        worker = min(self.workers, key=lambda w: len(w.inflight))
+        worker.inflight.add(task_id)
+        worker.send({"op": "build", "task_id": task_id, "args": args})
+
+    def handle(self, worker: ShardProcess, msg: dict):
+        op = msg.get("op")
+        if op == "status":
+            task_id = msg["task_id"]
+            scrape.tasks_status[task_id] = (msg["status"], msg["res"])
+            if msg["status"] not in ("scheduled", "running"):
+                worker.inflight.discard(task_id)
+        elif op == "acquire":
+            self.loop.create_task(self._grant(worker, msg["id"]))
+        elif op == "metrics":
+            PAGES_DOWNLOADED.inc(msg["pages"])
+            for host, n in msg["bytes"].items():
+                UPSTREAM_BYTES.inc(n, host=host)
+
+    async def _grant(self, worker: ShardProcess, request_id: int):
+        await self.api_rate.acquire()
+        if worker.alive:
+            worker.send({"op": "grant", "id": request_id})
+
+    def exited(self, worker: ShardProcess):
+        if not worker.alive:
+            return
+        worker.alive = False
+        for task_id in worker.inflight:
+            scrape.tasks_status[task_id] = ("error: worker process exited", "")
+        worker.inflight.clear()
+        log.warning("shard_exited", index=worker.index, code=worker.proc.poll())
+
+    def shutdown(self):
+        for worker in self.workers:
+            if worker.alive:
+                worker.send({"op": "stop"})
+                worker.alive = False
+        for worker in self.workers:
+            try:
+                worker.proc.wait(5)
+            except subprocess.TimeoutExpired:
+                worker.proc.kill()
+        self.workers = []
+        if utils.upstream_gate == self._local_gate:
+            utils.upstream_gate = None
+            # recreated with the whole budget on next use
+            utils.req_semaphore = None
+
+
+def get_pool() -> ShardPool:
+    """Return (and lazily create) the pool for the running event loop."""
+    global pool
+    if pool is None:
+        pool = ShardPool(scrape.shard_processes, asyncio.get_running_loop())
+    return pool
+
+
+def shutdown_pool():
+    global pool
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+
+
+# –– worker process side ––
+
+def worker_main():
+    # stdout carries the protocol; anything else printed goes to stderr
+    out = os.fdopen(os.dup(1), "w", encoding="utf-8", buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    asyncio.run(_worker_loop(sys.stdin, out))
+
+
+async def _worker_loop(inp, out):
+    loop = asyncio.get_running_loop()
+    inbox: asyncio.Queue = asyncio.Queue()
+
+    def read():
+        for line in inp:
+            loop.call_soon_threadsafe(inbox.put_nowait, json.loads(line))
+        loop.call_soon_threadsafe(inbox.put_nowait, None)
+    threading.Thread(target=read, daemon=True).start()
+
+    def send(msg: dict):
+        out.write(json.dumps(msg) + "\n")
+
+    grants: dict[int, asyncio.Future] = {}
+    request_ids = itertools.count(1)
+
+    async def gate(url: str):
+        if urlparse(url).netloc != _api_host():
+            return
+        request_id = next(request_ids)
+        grants[request_id] = loop.create_future()
+        send({"op": "acquire", "id": request_id})
+        await grants[request_id]
+
+    sent = {"pages": 0, "bytes": {}}
+
+    def flush_metrics():
+        # page and byte counters are forwarded so the parent's /metrics and
+        # batch summaries include work done in workers
+        pages = PAGES_DOWNLOADED.values.get((), 0)
+        by_host = {key[0]: n for key, n in UPSTREAM_BYTES.values.items()}
+        delta = {h: n - sent["bytes"].get(h, 0) for h, n in by_host.items()
+                 if n != sent["bytes"].get(h, 0)}
+        if pages != sent["pages"] or delta:
+            send({"op": "metrics", "pages": pages - sent["pages"], "bytes": delta})
+            sent.update({"pages": pages, "bytes": by_host})
+
+    async def report_metrics():
+        while True:
+            await asyncio.sleep(status_interval)
+            flush_metrics()
+
+    async def build(task_id: str, args: list):
+        scrape.tasks_status[task_id] = ("scheduled", "")
+        job = asyncio.create_task(scrape.put_mangadex_volume(task_id, *args))
+        last = None
+        while True:
+            done = job.done()
+            status = scrape.tasks_status[task_id]
+            if done:
+                flush_metrics()
+            if status != last:
+                send({"op": "status", "task_id": task_id,
+                      "status": status[0], "res": status[1]})
+                last = status
+            if done:
+                break
+            await asyncio.sleep(status_interval)
+        scrape.tasks_status.pop(task_id, None)
+        scrape.tasks_trace.pop(task_id, None)
+
+    utils.upstream_gate = gate
+    reporter = asyncio.create_task(report_metrics())
+    jobs: set[asyncio.Task] = set()
+    while True:
+        msg = await inbox.get()
+        if msg is None or msg["op"] == "stop":
+            break
+        if msg["op"] == "init":
+            cache.set_cache(cache.from_spec(msg["cache"]))
+            mangadex_api.MANGADEX_API_URL = msg["api_url"]
+            mangadex_api.MANGADEX_COVERS_URL = msg["covers_url"]
+            utils.parallel_request_limit, utils.req_semaphore = msg["request_limit"], None
+            scrape.parallel_worker_limit, scrape.worker_semaphore = msg["worker_limit"], None
+        elif msg["op"] == "grant":
+            future = grants.pop(msg["id"], None)
+            if future is not None and not future.done():
+                future.set_result(None)
+        elif msg["op"] == "build":
+            job = asyncio.create_task(build(msg["task_id"], msg["args"]))
+            jobs.add(job)
+            job.add_done_callback(jobs.discard)
+    # let running builds finish on a graceful stop
+    if msg is not None and jobs:
+        await asyncio.gather(*jobs, return_exceptions=True)
+    reporter.cancel()
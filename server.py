@@ -18,41 +18,46 @@
 
 import asyncio
 import json
-import logging
 import os
 import shutil
 import threading
+import time
 from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import unquote, urlparse, parse_qs
 
 from .req.search import search_for_manga_by_user_query_dict
-from .req.manga_info import get_manga_info_page
-from .req.scrape import get_mangadex_volume, get_task_status, get_cbz_file_path
+from .req.manga_info import get_manga_info_page, get_part_chapter_names
+from .req.scrape import get_mangadex_volume, get_task_status, get_task_chrome_trace, get_cbz_file_path
 from .lib.utils import is_localhost
+from .lib.transcode import TRANSCODE_PROFILES, DEFAULT_PROFILE
+from .lib.metrics import HTTP_REQUEST_SECONDS, render_metrics, monitor_event_loop_lag
+from .req import follow, prefetch
+from .lib import debug
+from .lib.events import event_log, get_logger, parse_level
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger(__name__)
+log = get_logger(__name__)
 
 
 class LocalServer(threading.Thread):
     daemon = True
 
-    def __init__(self, port):
+    def __init__(self, port: int = 0):
+        """
+        Bind immediately so a port conflict raises here instead of failing
+        silently in the thread; port 0 picks a free ephemeral port.
+        """
         super().__init__()
-        self.port = port
-        self.httpd = None
+        Handler.parent = self
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.port = self.httpd.server_address[1]
         self.loop = AioLoop()
         self.loop.start()
 
     def run(self):
         try:
-            Handler.parent = self
-            self.httpd = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
             self.httpd.serve_forever(poll_interval=0.5)
         except OSError as e:
-            print(f'Calibre plugin server failed: {e}')
+            log.error("server_failed", error=e)
 
     def shutdown(self):
         if self.httpd:
@@ -69,6 +74,7 @@ class AioLoop(threading.Thread):
 
     def run(self):
         asyncio.set_event_loop(self.loop)
+        self.loop.create_task(monitor_event_loop_lag())
         self.loop.run_forever()
 
     def schedule(self, coro):
@@ -81,16 +87,52 @@ class AioLoop(threading.Thread):
 class Handler(BaseHTTPRequestHandler):
     parent = None
 
+    def log_message(self, format, *args):
+        # keep per-request access lines off calibre's stderr
+        log.debug("http_request", client=self.client_address[0], line=format % args)
+
     def do_GET(self):
+        self._route = "not_found"
+        self._code = 0
+        start = time.monotonic()
+        try:
+            with debug.profile_current_thread():
+                self._do_GET()
+        finally:
+            HTTP_REQUEST_SECONDS.observe(
+                time.monotonic() - start, route=self._route, code=self._code)
+
+    def _do_GET(self):
         (ip, port) = self.client_address
         url = urlparse(self.path)
         path = url.path
         qs = parse_qs(url.query)
         path_parts = [p for p in path.split('/') if p != '']
-        logger.info(f"processing {path} {qs}")
         if not is_localhost(ip, port):
             self._send(404, b"text/html", b"")
+        elif path == '/metrics':
+            self._route = "metrics"
+            body = render_metrics().encode('utf-8')
+            self._send(200, b"text/plain; version=0.0.4; charset=utf-8", body)
+        elif path == '/prefetch':
+            self._route = "prefetch"
+            if 'enabled' in qs:
+                prefetch.prefetch_enabled = qs['enabled'][0] in ('1', 'true')
+            f = self.parent.loop.schedule(prefetch.get_prefetch_status())
+            body = json.dumps(f.result()).encode('utf-8')
+            self._send(200, b"application/json; charset=utf-8", body)
+        elif path_parts[:1] == ['follows']:
+            self._route = "follows"
+            self._do_follows(path_parts[1:], qs)
+        elif path_parts[:1] == ['events']:
+            self._route = "events"
+            self._do_events(path_parts[1:], qs)
+        elif len(path_parts) >= 2 and path_parts[0] == 'debug':
+            self._route = "debug"
+            self._do_debug(path_parts[1:], qs)
         elif path == '/search' and 'q' in qs and 'max_results' in qs:
+            self._route = "search"
+            self._preempt_prefetch()
             q = unquote(qs['q'][0])
             max_results = int(qs['max_results'][0])
             f = self.parent.loop.schedule(
@@ -98,38 +140,168 @@ class Handler(BaseHTTPRequestHandler):
             body = json.dumps(f.result(), ensure_ascii=False).encode('utf-8')
             self._send(200, b"application/json; charset=utf-8", body)
         elif len(path_parts) == 2 and path_parts[0] == 'manga':
+            self._route = "manga"
+            self._preempt_prefetch()
             manga_id = path_parts[1]
             f = self.parent.loop.schedule(get_manga_info_page(manga_id))
             body = f.result().encode('utf-8')
             self._send(200, b"text/html; charset=utf-8", body)
-        elif path == '/to_cbz' and {'manga_id', 'language', 'volume_name', 'chapter_names', 'prefix'} <= qs.keys():
+            # the user now reads the page; use the idle time
+            self.parent.loop.loop.call_soon_threadsafe(prefetch.schedule, manga_id)
+        elif path == '/to_cbz' and {'manga_id', 'language', 'volume_name', 'prefix'} <= qs.keys():
+            self._route = "to_cbz"
+            self._preempt_prefetch()
             prefix = qs['prefix'][0]
             manga_id = qs['manga_id'][0]
             language = qs['language'][0]
             volume_name = qs['volume_name'][0]
-            chapter_names = qs['chapter_names'][0]
             part = 0
             try:
                 part = int(qs['part'][0])
             except:
                 pass
+            data_saver = qs.get('data_saver', ['0'])[0] in ('1', 'true')
+            profile = qs.get('profile', [DEFAULT_PROFILE])[0]
+            if profile not in TRANSCODE_PROFILES:
+                body = json.dumps({"error": f"unknown profile: {profile}"}).encode('utf-8')
+                self._send(400, b"application/json; charset=utf-8", body)
+                return
+            if 'chapter_names' in qs:
+                chapter_names = qs['chapter_names'][0]
+            else:
+                # the part number refers to the server-side part plan
+                try:
+                    f = self.parent.loop.schedule(get_part_chapter_names(
+                        manga_id, language, volume_name, part))
+                    chapter_names = json.dumps(f.result())
+                except ValueError as e:
+                    body = json.dumps({"error": str(e)}).encode('utf-8')
+                    self._send(400, b"application/json; charset=utf-8", body)
+                    return
             f = self.parent.loop.schedule(get_mangadex_volume(
-                prefix, manga_id, language, volume_name, chapter_names, part))
+                prefix, manga_id, language, volume_name, chapter_names, part,
+                data_saver, profile))
             body = json.dumps(f.result(), ensure_ascii=False).encode('utf-8')
             self._send(200, b"application/json; charset=utf-8", body)
         elif len(path_parts) == 3 and path_parts[0] == 'task' and path_parts[2] == 'status':
+            self._route = "task_status"
             task_id = path_parts[1]
-            f = self.parent.loop.schedule(get_task_status(task_id))
+            timeline = qs.get('timeline', ['0'])[0] in ('1', 'true')
+            f = self.parent.loop.schedule(get_task_status(task_id, timeline))
             body = json.dumps(f.result(), ensure_ascii=False).encode('utf-8')
             self._send(200, b"application/json; charset=utf-8", body)
+        elif len(path_parts) == 3 and path_parts[0] == 'task' and path_parts[2] == 'trace':
+            self._route = "task_trace"
+            task_id = path_parts[1]
+            f = self.parent.loop.schedule(get_task_chrome_trace(task_id))
+            trace = f.result()
+            if trace is None:
+                self._send(404, b"application/json; charset=utf-8", b"{}")
+            else:
+                body = json.dumps(trace, ensure_ascii=False).encode('utf-8')
+                self._send(200, b"application/json; charset=utf-8", body)
         elif len(path_parts) == 2 and path_parts[0] == 'download':
+            self._route = "download"
             task_id = path_parts[1]
             (file_path, file_name) = get_cbz_file_path(task_id)
             self._send_zip(file_name, file_path)
         else:
             self._send(404, b"text/html", b"")
 
+    def _do_debug(self, parts, qs):
+        """Diagnostics for a running process; localhost-only like every route."""
+        try:
+            if parts == ['profile', 'start']:
+                mode = qs.get('mode', ['sampling'])[0]
+                interval = float(qs.get('interval_ms', ['10'])[0]) / 1000
+                text = debug.start_profiling(self.parent.loop.loop, mode, interval)
+            elif parts == ['profile', 'stop']:
+                text = debug.stop_profiling(int(qs.get('limit', ['60'])[0]))
+            elif parts == ['tracemalloc']:
+                text = debug.tracemalloc_snapshot(
+                    int(qs.get('top', ['25'])[0]), qs.get('group_by', ['lineno'])[0])
+            elif parts == ['tracemalloc', 'stop']:
+                text = debug.tracemalloc_stop()
+            elif parts == ['tasks']:
+                text = self.parent.loop.schedule(debug.dump_asyncio_tasks()).result()
+            else:
+                self._send(404, b"text/html", b"")
+                return
+        except (RuntimeError, ValueError) as e:
+            self._send(409, b"text/plain; charset=utf-8", str(e).encode('utf-8'))
+            return
+        self._send(200, b"text/plain; charset=utf-8", text.encode('utf-8'))
+
+    def _preempt_prefetch(self):
+        # runs before anything this request schedules on the loop
+        self.parent.loop.loop.call_soon_threadsafe(prefetch.preempt)
+
+    def _do_follows(self, parts, qs):
+        """
+        /follows, /follows/add?manga_id=&language=&data_saver=&profile=,
+        /follows/remove?manga_id=, /follows/sync, /follows/sync/status
+        """
+        if parts == []:
+            coro = follow.list_follows()
+        elif parts == ['add'] and 'manga_id' in qs and 'language' in qs:
+            coro = follow.add_follow(
+                qs['manga_id'][0], qs['language'],
+                qs.get('data_saver', ['0'])[0] in ('1', 'true'),
+                qs.get('profile', [DEFAULT_PROFILE])[0])
+        elif parts == ['remove'] and 'manga_id' in qs:
+            coro = follow.remove_follow(qs['manga_id'][0])
+        elif parts == ['sync']:
+            coro = follow.start_sync()
+        elif parts == ['sync', 'status']:
+            coro = follow.get_sync_status()
+        else:
+            self._send(404, b"text/html", b"")
+            return
+        try:
+            res = self.parent.loop.schedule(coro).result()
+        except ValueError as e:
+            body = json.dumps({"error": str(e)}).encode('utf-8')
+            self._send(400, b"application/json; charset=utf-8", body)
+            return
+        self._send(200, b"application/json; charset=utf-8",
+                   json.dumps(res, ensure_ascii=False).encode('utf-8'))
+
+    def _do_events(self, parts, qs):
+        """
+        /events?level=&name=&source=&since=&limit=&format=text|json
+        /events/config?level=&sample=name:rate
+        """
+        try:
+            if parts == []:
+                events = event_log.query(
+                    parse_level(qs.get('level', ['debug'])[0]),
+                    qs.get('name', [None])[0], qs.get('source', [None])[0],
+                    int(qs.get('since', ['0'])[0]), int(qs.get('limit', ['200'])[0]))
+                if qs.get('format', ['json'])[0] == 'text':
+                    text = "".join(e.to_text() + "\n" for e in events)
+                    self._send(200, b"text/plain; charset=utf-8", text.encode('utf-8'))
+                    return
+                body = {"events": [e.to_dict() for e in events]}
+            elif parts == ['config']:
+                level = parse_level(qs['level'][0]) if 'level' in qs else None
+                rates = {}
+                for spec in qs.get('sample', []):
+                    name, _, rate = spec.partition(':')
+                    rates[name] = float(rate)
+                event_log.configure(level, rates)
+                body = event_log.config()
+            else:
+                self._send(404, b"text/html", b"")
+                return
+        except ValueError as e:
+            body = json.dumps({"error": str(e)}).encode('utf-8')
+            self._send(400, b"application/json; charset=utf-8", body)
+            return
+        self._send(200, b"application/json; charset=utf-8",
+                   json.dumps(body, ensure_ascii=False).encode('utf-8'))
+
     def _send(self, code, ctype, body: bytes):
+        self._code = code
         self.send_response(code)
         self.send_header("Content-Type", ctype.decode())
         self.send_header("Content-Length", str(len(body)))
@@ -137,6 +309,7 @@ class Handler(BaseHTTPRequestHandler):
         self.wfile.write(body)
 
     def _send_zip(self, file_name, file_path):
+        self._code = 200
         self.send_response(200)
         self.send_header("Content-Type", "application/zip")
         self.send_header("Content-Length", str(os.path.getsize(file_path)))
@@ -0,0 +1,53 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+# Unit tests for the parts of the plugin that do not need a running calibre.
+# The plugin package is registered under its calibre name without running its
+# __init__.py (the GUI store plugin), and when calibre is not installed the
+# two calibre modules those parts import are stood in for by their stdlib
+# equivalents. Run from the repository root:
+#
+#   python -m pytest tests
+
+import os
+import sys
+import tempfile
+import types
+import zipfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "calibre_plugins.store_mangadex"
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = sys.modules[name] = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+try:
+    import calibre.utils.config  # noqa: F401
+    import calibre.utils.zipfile  # noqa: F401
+except ImportError:
+    _module("calibre", __path__=[])
+    _module("calibre.utils", __path__=[])
+    _module("calibre.utils.config", config_dir=tempfile.mkdtemp(prefix="mangadex-tests-"))
+    _module("calibre.utils.zipfile", ZipFile=zipfile.ZipFile)
+
+if PACKAGE not in sys.modules:
+    sys.modules.setdefault("calibre_plugins", types.ModuleType("calibre_plugins")).__path__ = []
+    _module(PACKAGE, __path__=[REPO_DIR])
@@ -0,0 +1,50 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import hashlib
+
+import pytest
+
+from calibre_plugins.store_mangadex.lib.integrity import IntegrityError, verify_page
+
+JPEG = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 4 + b"\xff\xd9"
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4 + b"\x00\x00\x00\x00IEND\xaeB`\x82"
+GIF = b"GIF89a" + bytes(range(256)) * 4 + b"\x3b"
+
+
+def _url(data: bytes, ext: str) -> str:
+    return f"https://node.example/data/chapterhash/1-{hashlib.sha256(data).hexdigest()}.{ext}"
+
+
+@pytest.mark.parametrize("data, ext", [(JPEG, "jpg"), (PNG, "png"), (GIF, "gif")])
+def test_verify_page_accepts_complete_images(data, ext):
+    verify_page(_url(data, ext), data)
+
+
+@pytest.mark.parametrize("data", [JPEG, PNG, GIF])
+def test_verify_page_rejects_truncated_images(data):
+    truncated = data[:len(data) // 2]
+    with pytest.raises(IntegrityError) as e:
+        verify_page("https://node.example/data-saver/chapterhash/1-x.jpg", truncated)
+    assert e.value.reason == "header"
+
+
+def test_verify_page_rejects_a_bad_sha256():
+    with pytest.raises(IntegrityError) as e:
+        verify_page(_url(JPEG, "jpg"), JPEG[:-2] + b"\x00\xff\xd9")
+    assert e.value.reason == "sha256"
+    assert e.value.digest == hashlib.sha256(JPEG[:-2] + b"\x00\xff\xd9").hexdigest()
@@ -0,0 +1,43 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import random
+
+import pytest
+
+from calibre_plugins.store_mangadex.req import manga_info
+from calibre_plugins.store_mangadex.req.manga_info import volume_parts
+
+
+def test_volume_parts_partitions_chapters_in_order():
+    for seed in range(200):
+        rng = random.Random(seed)
+        names = [str(i) for i in range(rng.randint(1, 40))]
+        pages = [rng.choice([1, 5, 20, 60, 400]) for _ in names]
+        parts = volume_parts(names, pages)
+        assert [n for _, part in parts for n in part] == names, seed
+        assert all(part for _, part in parts), seed
+        if len(parts) == 1:
+            assert parts[0][0] == 0, seed
+        else:
+            assert [p for p, _ in parts] == list(range(1, len(parts) + 1)), seed
+
+
+def test_volume_parts_splits_large_volumes(monkeypatch):
+    monkeypatch.setattr(manga_info, "part_target_bytes", 100 * manga_info.page_bytes_estimate)
+    assert volume_parts(["1", "2"], [10, 10]) == [(0, ["1", "2"])]
+    assert volume_parts(["1", "2", "3", "4"], [50, 50, 50, 50]) == [(1, ["1", "2"]), (2, ["3", "4"])]
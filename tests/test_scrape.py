@@ -0,0 +1,46 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+
+from calibre_plugins.store_mangadex.req import scrape
+
+OLD = "https://old.example/data/hash"
+NEW = "https://new.example/data/hash"
+
+
+def test_at_home_failover_moves_the_whole_chapter(monkeypatch):
+    fetched = []
+
+    async def get_chapter_image_urls(chapter_id, data_saver=False):
+        fetched.append(chapter_id)
+        return [f"{NEW}/1-a.jpg", f"{NEW}/2-b.jpg"]
+
+    monkeypatch.setattr(scrape, "get_chapter_image_urls", get_chapter_image_urls)
+    failover = scrape.AtHomeFailover()
+    failover.register("ch1", [f"{OLD}/1-a.jpg", f"{OLD}/2-b.jpg"])
+    assert failover.current(f"{OLD}/2-b.jpg") == f"{OLD}/2-b.jpg"
+
+    async def main():
+        # two pages failing at once ask for a new node only once
+        await asyncio.gather(failover.refresh("ch1", f"{OLD}/1-a.jpg"),
+                             failover.refresh("ch1", f"{OLD}/2-b.jpg"))
+
+    asyncio.run(main())
+    assert fetched == ["ch1"]
+    assert failover.current(f"{OLD}/1-a.jpg") == f"{NEW}/1-a.jpg"
+    assert failover.current(f"{OLD}/2-b.jpg") == f"{NEW}/2-b.jpg"
@@ -0,0 +1,73 @@
+"""
+ Copyright (c) 2025 qbit529
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program. If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+
+import pytest
+
+from calibre_plugins.store_mangadex.lib.utils import first_successful, retry_with_backoff
+
+
+def test_retry_with_backoff_returns_first_success():
+    calls = []
+
+    async def fn(attempt):
+        calls.append(attempt)
+        if attempt < 2:
+            raise OSError("flaky")
+        return "ok"
+
+    assert asyncio.run(retry_with_backoff(fn, attempts=4, base_delay=0)) == "ok"
+    assert calls == [0, 1, 2]
+
+
+def test_retry_with_backoff_reraises_last_error():
+    async def fn(attempt):
+        raise OSError(f"attempt {attempt}")
+
+    with pytest.raises(OSError, match="attempt 2"):
+        asyncio.run(retry_with_backoff(fn, attempts=3, base_delay=0))
+
+
+def test_first_successful_skips_failures_and_cancels_the_rest():
+    async def fail():
+        raise OSError("down")
+
+    async def value(v, delay):
+        await asyncio.sleep(delay)
+        return v
+
+    async def main():
+        slow = asyncio.create_task(value("slow", 10))
+        tasks = [asyncio.create_task(fail()), asyncio.create_task(value("fast", 0.01)), slow]
+        result = await first_successful(tasks)
+        await asyncio.sleep(0)
+        return result, slow.cancelled()
+
+    assert asyncio.run(main()) == ("fast", True)
+
+
+def test_first_successful_raises_when_every_task_fails():
+    async def fail(msg):
+        raise OSError(msg)
+
+    async def main():
+        return await first_successful([asyncio.create_task(fail("a")),
+                                       asyncio.create_task(fail("b"))])
+
+    with pytest.raises(OSError):
+        asyncio.run(main())